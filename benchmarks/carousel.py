@@ -0,0 +1,64 @@
+"""
+Compare building the order carousels on every request with reusing the
+precompiled messages, for a menu of 200 items in a single category
+
+Usage: python -m benchmarks.carousel [item_count]
+"""
+import asyncio
+import sys
+import time
+import timeit
+
+from tortoise import Tortoise
+
+from restaurant_bot.catalog import menu_catalog
+from restaurant_bot.cogs.order import OrderCog, build_carousel_messages
+from restaurant_bot.models import Item, ItemCategory
+
+
+async def main(item_count: int) -> None:
+    await Tortoise.init(
+        db_url="sqlite://:memory:", modules={"models": ["restaurant_bot.models"]}
+    )
+    await Tortoise.generate_schemas()
+    await Item.bulk_create(
+        [
+            Item(
+                name=f"餐點 {i}",
+                description="柔軟的麵包, 搭配融化的起司",
+                category=ItemCategory.FOOD,
+                price=100 + i,
+                image_url=f"https://example.com/{i}.png",
+            )
+            for i in range(item_count)
+        ]
+    )
+    items = (await menu_catalog.get_category(ItemCategory.FOOD))[::-1]
+
+    # The cog is only used for its cache, bypass Cog.__init__
+    cog = OrderCog.__new__(OrderCog)
+    cog._init_carousel_cache()
+    await cog._get_carousel_messages(ItemCategory.FOOD)
+
+    async def reuse_timing(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await cog._get_carousel_messages(ItemCategory.FOOD)
+        return (time.perf_counter() - start) / number
+
+    number = 200
+    rebuild = (
+        min(timeit.repeat(lambda: build_carousel_messages(items), number=number))
+        / number
+    )
+    reuse = min([await reuse_timing(number) for _ in range(5)])
+
+    print(f"items: {item_count}")
+    print(f"rebuild per request: {rebuild * 1e6:.1f} us")
+    print(f"precompiled per request: {reuse * 1e6:.1f} us")
+    print(f"saved per request: {(rebuild - reuse) * 1e6:.1f} us")
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,161 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Optional
+
+from .models import User
+
+# scrypt cost of new hashes, existing hashes keep the cost they were made with
+SCRYPT_N = 2**14
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_PREFIX = "scrypt"
+
+
+def hash_password(
+    password: str, *, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P
+) -> str:
+    """
+    Hash a password with a random salt, the cost parameters are stored in the hash
+    """
+    salt = os.urandom(16)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=32)
+    return "$".join(
+        (
+            HASH_PREFIX,
+            str(n),
+            str(r),
+            str(p),
+            base64.b64encode(salt).decode(),
+            base64.b64encode(key).decode(),
+        )
+    )
+
+
+def is_password_hash(value: str) -> bool:
+    return value.startswith(f"{HASH_PREFIX}$")
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    try:
+        prefix, n, r, p, salt, key = password_hash.split("$")
+    except ValueError:
+        return False
+    if prefix != HASH_PREFIX:
+        return False
+    expected = base64.b64decode(key)
+    actual = hashlib.scrypt(
+        password.encode(),
+        salt=base64.b64decode(salt),
+        n=int(n),
+        r=int(r),
+        p=int(p),
+        dklen=len(expected),
+    )
+    return hmac.compare_digest(actual, expected)
+
+
+# Verified against unknown login names so they take as long as known ones
+DUMMY_HASH = hash_password(os.urandom(16).hex())
+
+
+class LoginRateLimiter:
+    """
+    Counts failed logins per key in memory and blocks keys with too many
+
+    Parameters:
+        max_failures: How many failures a key may have within `window`
+        window: Seconds a failure is counted for
+        max_keys: How many keys are tracked, the least recently failed are dropped
+    """
+
+    def __init__(
+        self, *, max_failures: int = 5, window: float = 300, max_keys: int = 10000
+    ) -> None:
+        self.max_failures = max_failures
+        self.window = window
+        self.max_keys = max_keys
+        self._failures: OrderedDict[str, Deque[float]] = OrderedDict()
+
+    def _recent_failures(self, key: str) -> Optional[Deque[float]]:
+        failures = self._failures.get(key)
+        if failures is None:
+            return None
+        cutoff = time.monotonic() - self.window
+        while failures and failures[0] < cutoff:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return None
+        return failures
+
+    def is_blocked(self, key: str) -> bool:
+        failures = self._recent_failures(key)
+        return failures is not None and len(failures) >= self.max_failures
+
+    def record_failure(self, key: str) -> None:
+        failures = self._recent_failures(key)
+        if failures is None:
+            failures = self._failures[key] = deque()
+        failures.append(time.monotonic())
+        self._failures.move_to_end(key)
+        while len(self._failures) > self.max_keys:
+            self._failures.popitem(last=False)
+
+    def reset(self, key: str) -> None:
+        self._failures.pop(key, None)
+
+
+class Authenticator:
+    """
+    Checks admin logins, hashing runs in worker threads so the event loop never waits
+
+    Parameters:
+        max_concurrent_checks: How many passwords are verified at the same time
+    """
+
+    def __init__(self, *, max_concurrent_checks: int = 4) -> None:
+        self.rate_limiter = LoginRateLimiter()
+        self._checks = asyncio.Semaphore(max_concurrent_checks)
+
+    async def authenticate(
+        self, login_name: str, password: str, client: str = ""
+    ) -> Optional[User]:
+        """
+        Returns the admin with the login name and password, None if they don't
+        match or there were too many failed attempts. Only users with is_admin
+        set can log in.
+
+        Parameters:
+            login_name: The login name
+            password: The plaintext password
+            client: The client's IP address, failures are also limited per
+                client unless it is empty. Behind a reverse proxy, the proxy has
+                to forward the real address, otherwise every login shares the
+                proxy's address and a few wrong passwords lock everyone out.
+        """
+        name_key = f"name:{login_name}"
+        keys = [name_key]
+        if client:
+            keys.append(f"client:{client}")
+        if any(self.rate_limiter.is_blocked(key) for key in keys):
+            return None
+
+        user = await User.get_or_none(login_name=login_name, is_admin=True)
+        password_hash = user.password if user and user.password else DUMMY_HASH
+        async with self._checks:
+            valid = await asyncio.to_thread(verify_password, password, password_hash)
+        if user is None or not valid:
+            for key in keys:
+                self.rate_limiter.record_failure(key)
+            return None
+
+        self.rate_limiter.reset(name_key)
+        return user
+
+
+authenticator = Authenticator()
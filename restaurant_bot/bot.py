@@ -1,42 +1,234 @@
+import asyncio
+import functools
+import hashlib
+import json
 import logging
 from pathlib import Path
+from typing import Optional
 
+from aiohttp import web
 from line import Bot
+from linebot.v3.messaging import ApiException
+from linebot.v3.webhooks import MessageEvent, PostbackEvent
 from tortoise import Tortoise
 
+from .dedupe import EventDeduplicator
+from .http_client import HTTPClient
+from .images import image_store
+from .intake import EventQueue, get_command_name, get_event_key
+from .metrics import Metrics
+from .migrations import migrate
+from .models import PointTransaction, Setting
+from .qr import QRCodeCache
+from .reports import SalesRollupJob
 from .rich_menu import RICH_MENU
+from .tasks import BatchWriter, CouponExpirySweeper
+from .users import UserResolver
+
+RICH_MENU_SETTING_KEY = "rich_menu"
 
 
 class RestaurantBot(Bot):
-    def __init__(self, channel_secret: str, access_token: str, db_url: str) -> None:
+    def __init__(
+        self,
+        channel_secret: str,
+        access_token: str,
+        db_url: str,
+        public_url: str,
+        *,
+        primary: bool = True,
+        shared_dedupe: bool = False,
+        query_metrics: bool = False,
+    ) -> None:
         super().__init__(channel_secret=channel_secret, access_token=access_token)
         self.db_url = db_url
+        self.public_url = public_url.rstrip("/")
+        # Only the primary worker sets up the rich menu and runs the sweeper
+        self.primary = primary
+        self.qr_codes = QRCodeCache()
+        self.http_client = HTTPClient()
+        self.users = UserResolver(self.line_bot_api)
+        self.coupon_sweeper = CouponExpirySweeper()
+        self.sales_rollup = SalesRollupJob()
+        self.point_ledger = BatchWriter(PointTransaction)
+        self.event_queue = EventQueue()
+        # Workers share the dedupe keys through the database
+        self.deduplicator = EventDeduplicator(use_database=shared_dedupe)
+        self._rich_menu_cleanup: Optional[asyncio.Task[None]] = None
+        self.metrics = Metrics()
+        # Timing queries patches the database client classes of the whole
+        # process, so it is left to the entry point to ask for it
+        self.query_metrics = query_metrics
+        self.metrics.instrument_line_api(self.line_bot_api.api_client)
+        if self.blob_api.api_client is not self.line_bot_api.api_client:
+            self.metrics.instrument_line_api(self.blob_api.api_client)
+        self.metrics.callbacks.update(
+            {
+                "event_queue_depth": (
+                    "gauge",
+                    "Events waiting to be handled",
+                    lambda: self.event_queue.depth,
+                ),
+                "event_queue_max_wait_seconds": (
+                    "gauge",
+                    "Longest time an event waited in the queue",
+                    lambda: self.event_queue.max_wait_time,
+                ),
+                "user_cache_hits_total": (
+                    "counter",
+                    "Users served from the cache",
+                    lambda: self.users.hits,
+                ),
+                "user_cache_misses_total": (
+                    "counter",
+                    "Users loaded from the database",
+                    lambda: self.users.misses,
+                ),
+            }
+        )
+
+    async def get_qr_code_url(self, data: str) -> str:
+        digest = await self.qr_codes.ensure(data)
+        return f"{self.public_url}/restaurant/qr/{digest}.png"
+
+    async def _qr_code(self, request: web.Request) -> web.Response:
+        png = await self.qr_codes.read(request.match_info["digest"])
+        if png is None:
+            raise web.HTTPNotFound()
+        return web.Response(
+            body=png,
+            content_type="image/png",
+            headers={"Cache-Control": "public, max-age=31536000, immutable"},
+        )
+
+    async def _image(self, request: web.Request) -> web.StreamResponse:
+        path = image_store.path(request.match_info["filename"])
+        if not path.is_file():
+            raise web.HTTPNotFound()
+        # Filenames are content hashes, so a file never changes
+        return web.FileResponse(
+            path, headers={"Cache-Control": "public, max-age=31536000, immutable"}
+        )
+
+    async def _metrics(self, _: web.Request) -> web.Response:
+        return web.Response(
+            text=self.metrics.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    # Events are acknowledged as soon as they are queued, the handlers run in
+    # the event queue workers
+    async def on_message(self, event: MessageEvent) -> None:
+        if await self.deduplicator.is_duplicate(event):
+            return
+        await self.event_queue.put(
+            get_event_key(event),
+            functools.partial(
+                self.metrics.track_command,
+                get_command_name(event),
+                functools.partial(super().on_message, event),
+            ),
+        )
+
+    async def on_postback(self, event: PostbackEvent) -> None:
+        if await self.deduplicator.is_duplicate(event):
+            return
+        await self.event_queue.put(
+            get_event_key(event),
+            functools.partial(
+                self.metrics.track_command,
+                get_command_name(event),
+                functools.partial(super().on_postback, event),
+            ),
+        )
 
     async def _setup_rich_menu(self) -> None:
+        image = await asyncio.to_thread(Path("data/rich_menu.png").read_bytes)
+        fingerprint = hashlib.sha256(RICH_MENU.to_json().encode() + image).hexdigest()
+
+        setting = await Setting.get_or_none(key=RICH_MENU_SETTING_KEY)
+        if setting is not None:
+            stored = json.loads(setting.value)
+            if stored["fingerprint"] == fingerprint:
+                try:
+                    default = await self.line_bot_api.get_default_rich_menu_id()
+                except ApiException:
+                    default = None
+                if default is not None and default.rich_menu_id == stored["id"]:
+                    logging.info("Rich menu is up to date")
+                    return
+
         result = await self.line_bot_api.create_rich_menu(RICH_MENU)
-        with open("data/rich_menu.png", "rb") as f:
-            await self.blob_api.set_rich_menu_image(
-                result.rich_menu_id,
-                body=bytearray(f.read()),
-                _headers={"Content-Type": "image/png"},
-            )
+        await self.blob_api.set_rich_menu_image(
+            result.rich_menu_id,
+            body=bytearray(image),
+            _headers={"Content-Type": "image/png"},
+        )
         await self.line_bot_api.set_default_rich_menu(result.rich_menu_id)
+        await Setting.update_or_create(
+            key=RICH_MENU_SETTING_KEY,
+            defaults={
+                "value": json.dumps(
+                    {"fingerprint": fingerprint, "id": result.rich_menu_id}
+                )
+            },
+        )
+        self._rich_menu_cleanup = asyncio.create_task(
+            self._delete_superseded_rich_menus(result.rich_menu_id)
+        )
+
+    async def _delete_superseded_rich_menus(self, current_id: str) -> None:
+        try:
+            result = await self.line_bot_api.get_rich_menu_list()
+            for rich_menu in result.richmenus:
+                if (
+                    rich_menu.name == RICH_MENU.name
+                    and rich_menu.rich_menu_id != current_id
+                ):
+                    await self.line_bot_api.delete_rich_menu(rich_menu.rich_menu_id)
+                    logging.info("Deleted rich menu %s", rich_menu.rich_menu_id)
+        except Exception:
+            logging.exception("Failed to delete superseded rich menus")
 
     async def setup_hook(self) -> None:
+        await self.http_client.start()
+
         for cog in Path("restaurant_bot/cogs").glob("*.py"):
             if cog.stem == "__init__":
                 continue
             logging.info("Loading cog %s", cog.stem)
             self.add_cog(f"restaurant_bot.cogs.{cog.stem}")
 
-        logging.info("Setting up rich menu")
-        await self._setup_rich_menu()
+        self.qr_codes.load()
+        self.app.router.add_get(
+            "/restaurant/qr/{digest:[0-9a-f]{32}}.png", self._qr_code
+        )
+        # Scraped on the bot's port directly, not through the public /restaurant prefix
+        self.app.router.add_get("/metrics", self._metrics)
+        self.app.router.add_get(
+            r"/restaurant/images/{filename:[0-9a-f]{32}\.(?:jpg|webp)}", self._image
+        )
+
         logging.info("Setting up database")
         await Tortoise.init(
             db_url=self.db_url,
             modules={"models": ["restaurant_bot.models"]},
         )
-        await Tortoise.generate_schemas()
+        if self.query_metrics:
+            self.metrics.instrument_database(Tortoise.get_connection("default"))
+        await migrate()
+        await image_store.start(self.http_client, self.public_url)
+        self.point_ledger.start()
+        self.event_queue.start()
+        if self.primary:
+            logging.info("Setting up rich menu")
+            await self._setup_rich_menu()
+            self.coupon_sweeper.start()
+            self.sales_rollup.start()
 
     async def on_close(self) -> None:
+        await self.event_queue.stop()
+        await self.coupon_sweeper.stop()
+        await self.sales_rollup.stop()
+        await self.point_ledger.stop()
+        await self.http_client.close()
         await Tortoise.close_connections()
@@ -0,0 +1,95 @@
+import asyncio
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from .models import Item, ItemCategory, Setting
+
+MENU_VERSION_KEY = "menu_version"
+
+
+class MenuCatalog:
+    """
+    In-process cache of the menu, indexed by category and id
+
+    The cache is loaded lazily and reloaded whenever the menu version stamp
+    stored in the Setting table changes. The stamp is re-read at most once
+    every `version_check_interval` seconds, so browsing the menu costs no
+    queries in the steady state.
+    """
+
+    def __init__(self, *, version_check_interval: float = 5.0) -> None:
+        self.version_check_interval = version_check_interval
+        self.version: Optional[str] = None
+        # Incremented on every reload, lets callers key derived data off the catalog
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._items_by_id: Dict[int, Item] = {}
+        self._items_by_category: Dict[ItemCategory, List[Item]] = {}
+        self._loaded = False
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._loaded
+            and time.monotonic() - self._checked_at < self.version_check_interval
+        )
+
+    async def _ensure_loaded(self) -> None:
+        if self._is_fresh():
+            self.hits += 1
+            return
+
+        async with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return
+
+            # Read the stamp before the items so a concurrent write is picked
+            # up by the next check instead of being cached under a new stamp
+            setting = await Setting.get_or_none(key=MENU_VERSION_KEY)
+            version = setting.value if setting else None
+            self._checked_at = time.monotonic()
+            if self._loaded and version == self.version:
+                self.hits += 1
+                return
+
+            self.misses += 1
+            items = await Item.all().order_by("id")
+            self._items_by_id = {item.id: item for item in items}
+            self._items_by_category = {category: [] for category in ItemCategory}
+            for item in items:
+                self._items_by_category[item.category].append(item)
+            self.version = version
+            self.generation += 1
+            self._loaded = True
+
+    async def get_category(self, category: ItemCategory) -> List[Item]:
+        await self._ensure_loaded()
+        return self._items_by_category[category]
+
+    async def get_items(self, item_ids: Iterable[int]) -> Dict[int, Item]:
+        await self._ensure_loaded()
+        return {
+            item_id: self._items_by_id[item_id]
+            for item_id in item_ids
+            if item_id in self._items_by_id
+        }
+
+    def invalidate(self) -> None:
+        self._loaded = False
+
+    async def bump_version(self) -> None:
+        """
+        Stamp the menu with a new version, call this after every write to the item table
+        """
+        await Setting.update_or_create(
+            key=MENU_VERSION_KEY, defaults={"value": uuid.uuid4().hex}
+        )
+        self.invalidate()
+
+
+menu_catalog = MenuCatalog()
@@ -1,7 +1,6 @@
-from typing import Any, List, Optional
+from typing import Any, List, Optional, Tuple
 
-import qrcode
-from line import Bot, Cog, Context, command
+from line import Cog, Context, command
 from line.models import (
     ButtonsTemplate,
     PostbackAction,
@@ -9,25 +8,83 @@ from line.models import (
     QuickReplyItem,
     URIAction,
 )
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.queryset import QuerySet
 
-from ..models import Coupon, User
-from ..utils import split_list, upload_image
+from ..bot import RestaurantBot
+from ..models import Coupon, PointTransaction, User, UserCoupon
+from ..utils import get_now, get_today, split_list
+
+
+class Wallet:
+    @staticmethod
+    def usable_coupons(user_id: str) -> QuerySet[UserCoupon]:
+        return UserCoupon.filter(
+            user_id=user_id, quantity__gt=0, coupon__expire_date__gte=get_today()
+        )
+
+    @staticmethod
+    async def change_points(user_id: str, delta: int) -> bool:
+        """
+        Add delta to the user's points in one statement, fails instead of going negative
+        """
+        return bool(
+            await User.filter(id=user_id, points__gte=max(0, -delta)).update(
+                points=F("points") + delta
+            )
+        )
+
+    @staticmethod
+    async def grant(user_id: str, coupon_id: int, amount: int = 1) -> None:
+        holdings = UserCoupon.filter(user_id=user_id, coupon_id=coupon_id)
+        if await holdings.update(quantity=F("quantity") + amount):
+            return
+        try:
+            await UserCoupon.create(
+                user_id=user_id, coupon_id=coupon_id, quantity=amount
+            )
+        except IntegrityError:
+            await holdings.update(quantity=F("quantity") + amount)
+
+    @staticmethod
+    async def redeem(user_id: str, coupon_id: int) -> bool:
+        holdings = UserCoupon.filter(user_id=user_id, coupon_id=coupon_id)
+        if not await holdings.filter(quantity__gt=0).update(quantity=F("quantity") - 1):
+            return False
+        await holdings.filter(quantity=0).delete()
+        return True
 
 
 class AccountCog(Cog):
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: RestaurantBot):
         self.bot = bot
         super().__init__(bot)
 
+    async def _get_admin_and_target(
+        self, ctx: Context, user_id: str
+    ) -> Tuple[Optional[User], Optional[User]]:
+        """
+        Get the command user and the target user in one lookup, replies and returns
+        None for both if the command user isn't an admin or the target doesn't exist
+        """
+        users = await self.bot.users.get_many([ctx.user_id, user_id], fresh=True)
+        command_user = users.get(ctx.user_id)
+        if command_user is None or not command_user.is_admin:
+            await ctx.reply_text(text="你不是管理員")
+            return None, None
+        target_user = users.get(user_id)
+        if target_user is None:
+            await ctx.reply_text(text="找不到這位會員")
+            return None, None
+        return command_user, target_user
+
     @command
     async def account(self, ctx: Context) -> Any:
-        user = await User.get_or_none(id=ctx.user_id)
-        if user is None:
-            profile = await self.bot.line_bot_api.get_profile(ctx.user_id)
-            user = await User.create(
-                id=ctx.user_id,
-                name=profile.display_name,
-            )
+        user = await self.bot.users.resolve(ctx.user_id, fresh=True)
+        coupon_count = sum(
+            await Wallet.usable_coupons(user.id).values_list("quantity", flat=True)
+        )
 
         actions: List[PostbackAction | URIAction] = [
             PostbackAction(
@@ -41,7 +98,7 @@ class AccountCog(Cog):
                 display_text="請讓店員掃描下方的 QR Code, 完成後點擊「會員」可確認優惠卷是否成功入賬",
             ),
         ]
-        if user.coupon_ids:
+        if coupon_count:
             actions.append(
                 PostbackAction(
                     label="我的優惠券",
@@ -57,24 +114,30 @@ class AccountCog(Cog):
             )
         template = ButtonsTemplate(
             title=f"你好, {user.name}",
-            text=f"點數: {user.points} 點\n優惠券: {len(user.coupon_ids)} 張\n身份: {'管理員' if user.is_admin else '會員'}",
+            text=f"點數: {user.points} 點\n優惠券: {coupon_count} 張\n身份: {'管理員' if user.is_admin else '會員'}",
             actions=actions,  # type: ignore
         )
         await ctx.reply_template(alt_text="會員", template=template)
 
     @command
     async def show_coupons(self, ctx: Context, index: int = 0) -> Any:
-        user = await User.get(id=ctx.user_id)
-        all_coupon_ids = user.coupon_ids
-        split_coupon_ids = split_list(list(set(all_coupon_ids)), 11)
+        # Deleted and expired coupons are left out, sorted so pages are stable
+        holdings = (
+            await Wallet.usable_coupons(ctx.user_id)
+            .select_related("coupon")
+            .order_by("coupon__expire_date", "coupon_id")
+        )
+        if not holdings:
+            return await ctx.reply_text("你目前沒有可使用的優惠卷")
+        split_holdings = split_list(holdings, 11)
+        index = min(index, len(split_holdings) - 1)
 
         items: List[QuickReplyItem] = []
-        for coupon_id in split_coupon_ids[index]:
-            coupon = await Coupon.get(id=coupon_id)
-            coupon_count = all_coupon_ids.count(coupon_id)
+        for holding in split_holdings[index]:
+            coupon = holding.coupon
             item = QuickReplyItem(
                 action=PostbackAction(
-                    label=f"{coupon.name} x{coupon_count}",
+                    label=f"{coupon.name} x{holding.quantity}",
                     data=f"cmd=coupon_detail&coupon_id={coupon.id}",
                 )
             )
@@ -88,7 +151,7 @@ class AccountCog(Cog):
                     )
                 ),
             )
-        if index < len(split_coupon_ids) - 1:
+        if index < len(split_holdings) - 1:
             items.append(
                 QuickReplyItem(
                     action=PostbackAction(
@@ -120,9 +183,10 @@ class AccountCog(Cog):
     @command
     async def use_coupon(self, ctx: Context, coupon_id: int) -> Any:
         coupon = await Coupon.get(id=coupon_id)
-        user = await User.get(id=ctx.user_id)
-        user.coupon_ids.remove(coupon.id)
-        await user.save()
+        if coupon.expire_date < get_today():
+            return await ctx.reply_text(text=f"{coupon.name} 優惠卷已過期")
+        if not await Wallet.redeem(ctx.user_id, coupon.id):
+            return await ctx.reply_text(text=f"你沒有 {coupon.name} 優惠卷")
         await ctx.reply_text(text=f"成功使用 {coupon.name} 優惠卷")
 
     @command
@@ -131,11 +195,10 @@ class AccountCog(Cog):
     ) -> Any:
         if not user_id:
             url = f"https://line.me/R/oaMessage/%40402kzhrk/?cmd=earn_coupon&user_id={ctx.user_id}"
-            image = qrcode.make(url)
-            image_url = await upload_image(image)
+            image_url = await self.bot.get_qr_code_url(url)
             return await ctx.reply_image(image_url)
 
-        command_user = await User.get(id=ctx.user_id)
+        command_user = await self.bot.users.resolve(ctx.user_id, fresh=True)
         if not command_user.is_admin:
             return await ctx.reply_text(text="你不是管理員")
 
@@ -180,14 +243,14 @@ class AccountCog(Cog):
 
     @command
     async def give_coupon(self, ctx: Context, user_id: str, coupon_id: int) -> Any:
-        user_to_give_coupon = await User.get(id=user_id)
-        command_user = await User.get(id=ctx.user_id)
-        if not command_user.is_admin:
-            return await ctx.reply_text(text="你不是管理員")
+        command_user, user_to_give_coupon = await self._get_admin_and_target(
+            ctx, user_id
+        )
+        if command_user is None or user_to_give_coupon is None:
+            return
 
         coupon = await Coupon.get(id=coupon_id)
-        user_to_give_coupon.coupon_ids.append(coupon.id)
-        await user_to_give_coupon.save()
+        await Wallet.grant(user_to_give_coupon.id, coupon.id)
         await ctx.reply_text(
             text=f"成功, 已給予 {user_to_give_coupon.name} {coupon.name} 優惠卷"
         )
@@ -196,14 +259,14 @@ class AccountCog(Cog):
     async def earn_points(self, ctx: Context, user_id: Optional[str] = None) -> Any:
         if not user_id:
             url = f"https://line.me/R/oaMessage/%40402kzhrk/?cmd=earn_points&user_id={ctx.user_id}"
-            image = qrcode.make(url)
-            image_url = await upload_image(image)
+            image_url = await self.bot.get_qr_code_url(url)
             return await ctx.reply_image(image_url)
 
-        user_to_give_point = await User.get(id=user_id)
-        command_user = await User.get(id=ctx.user_id)
-        if not command_user.is_admin:
-            return await ctx.reply_text(text="你不是管理員")
+        command_user, user_to_give_point = await self._get_admin_and_target(
+            ctx, user_id
+        )
+        if command_user is None or user_to_give_point is None:
+            return
 
         template = ButtonsTemplate(
             title=f"你好, {command_user.name}",
@@ -224,11 +287,22 @@ class AccountCog(Cog):
 
     @command
     async def give_points(self, ctx: Context, user_id: str, points: int) -> Any:
-        user_to_give_point = await User.get(id=user_id)
-        command_user = await User.get(id=ctx.user_id)
-        if not command_user.is_admin:
-            return await ctx.reply_text(text="你不是管理員")
+        command_user, user_to_give_point = await self._get_admin_and_target(
+            ctx, user_id
+        )
+        if command_user is None or user_to_give_point is None:
+            return
 
-        user_to_give_point.points += points
-        await user_to_give_point.save()
+        if not await Wallet.change_points(user_to_give_point.id, points):
+            return await ctx.reply_text(text=f"失敗, {user_to_give_point.name} 的點數不足")
+        self.bot.users.invalidate(user_to_give_point.id)
+        self.bot.point_ledger.add(
+            PointTransaction(
+                user_id=user_to_give_point.id,
+                delta=points,
+                reason="give_points",
+                operator_id=command_user.id,
+                created_at=get_now(),
+            )
+        )
         await ctx.reply_text(text=f"成功, 已給予 {user_to_give_point.name} {points} 點")
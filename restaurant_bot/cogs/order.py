@@ -1,6 +1,6 @@
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 
-from line import Bot, Cog, Context, command
+from line import Cog, Context, command
 from line.models import (
     CarouselColumn,
     CarouselTemplate,
@@ -11,34 +11,56 @@ from line.models import (
     TemplateMessage,
     TextMessage,
 )
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
 
-from ..models import Item, ItemCategory, User
+from ..bot import RestaurantBot
+from ..catalog import menu_catalog
+from ..images import image_store
+from ..models import CartLine, Item, ItemCategory, Order, OrderLine
 from ..utils import get_now, split_list
 
 
 class Cart:
     def __init__(self):
         self.items: List[Item] = []
+        self.quantities: Dict[int, int] = {}
+        self.missing_item_ids: List[int] = []
         self.total_price = 0
         self.display_text = ""
         self.quick_reply: QuickReply
 
-    async def create(self, item_ids: List[int]) -> "Cart":
-        if not item_ids:
+    async def create(self, user_id: str) -> "Cart":
+        self.quantities = dict(
+            await CartLine.filter(user_id=user_id)
+            .order_by("id")
+            .values_list("item_id", "quantity")
+        )
+        if not self.quantities:
             self.display_text = "你目前尚未點選任何餐點"
             self.quick_reply = QuickReply(
                 [QuickReplyItem(PostbackAction("點餐", data="cmd=order"))]
             )
             return self
-        for cart_item_id in set(item_ids):
-            cart_item = await Item.get(id=cart_item_id)
+
+        cart_items = await menu_catalog.get_items(self.quantities)
+        for cart_item_id, item_amount in self.quantities.items():
+            cart_item = cart_items.get(cart_item_id)
+            if cart_item is None:
+                self.missing_item_ids.append(cart_item_id)
+                continue
             self.items.append(cart_item)
-            item_amount = item_ids.count(cart_item_id)
             item_total_price = cart_item.price * item_amount
             self.total_price += item_total_price
             self.display_text += (
                 f"{cart_item.name} x{item_amount} (NT$ {item_total_price})\n"
             )
+        if self.missing_item_ids:
+            missing_amount = sum(
+                self.quantities[item_id] for item_id in self.missing_item_ids
+            )
+            self.display_text += f"已下架的餐點 x{missing_amount} (不計入金額)\n"
         self.display_text += f"\n總金額: NT$ {self.total_price}"
         self.quick_reply = QuickReply(
             items=[
@@ -55,10 +77,105 @@ class Cart:
         )
         return self
 
+    async def checkout(self, user_id: str) -> Order:
+        """
+        Record the priced cart as an order and take its lines out of the cart in
+        one transaction, items added since the cart was read stay in the cart
+        """
+        now = get_now()
+        async with in_transaction():
+            order = await Order.create(
+                user_id=user_id, total_price=self.total_price, created_at=now
+            )
+            await OrderLine.bulk_create(
+                [
+                    OrderLine(
+                        order=order,
+                        item_id=item.id,
+                        item_name=item.name,
+                        unit_price=item.price,
+                        quantity=self.quantities[item.id],
+                        created_date=now.date(),
+                    )
+                    for item in self.items
+                ]
+            )
+            for item_id, amount in self.quantities.items():
+                await self.remove(user_id, item_id, amount)
+        return order
+
+    @staticmethod
+    async def add(user_id: str, item_id: int, amount: int) -> None:
+        lines = CartLine.filter(user_id=user_id, item_id=item_id)
+        if await lines.update(quantity=F("quantity") + amount):
+            return
+        try:
+            await CartLine.create(user_id=user_id, item_id=item_id, quantity=amount)
+        except IntegrityError:
+            # Either a concurrent postback created the line first or the item
+            # was deleted; the update is a no-op in the latter case.
+            await lines.update(quantity=F("quantity") + amount)
+
+    @staticmethod
+    async def remove(user_id: str, item_id: int, amount: int) -> None:
+        lines = CartLine.filter(user_id=user_id, item_id=item_id)
+        if await lines.filter(quantity__gt=amount).update(
+            quantity=F("quantity") - amount
+        ):
+            return
+        await lines.filter(quantity__lte=amount).delete()
+
+    @staticmethod
+    async def clear(user_id: str) -> None:
+        await CartLine.filter(user_id=user_id).delete()
+
+
+def build_carousel_messages(items: List[Item]) -> List[TemplateMessage]:
+    templates: List[CarouselTemplate] = []
+    for split_items in split_list(items, 10):
+        columns: List[CarouselColumn] = []
+        for item in split_items:
+            data = f"cmd=confirm_order&item_id={item.id}&item_name={item.name}&item_price={item.price}"
+            column = CarouselColumn(
+                thumbnail_image_url=image_store.get_url(item.image_url, "carousel")
+                or item.image_url
+                or "https://i.ibb.co/h7sVKj2/Frame-5.png",
+                title=item.name,
+                text=f"{item.price} 元\n{item.description[:20]}",
+                actions=[
+                    PostbackAction(label="點一份", data=f"{data}&amount=1"),
+                    PostbackAction(label="點兩份", data=f"{data}&amount=2"),
+                    PostbackAction(label="點三份", data=f"{data}&amount=3"),
+                ],
+            )
+            columns.append(column)
+        templates.append(CarouselTemplate(columns=columns))
+    return [TemplateMessage("點餐", template=template) for template in templates]
+
 
 class OrderCog(Cog):
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: RestaurantBot):
+        self.bot = bot
         super().__init__(bot)
+        self._init_carousel_cache()
+
+    def _init_carousel_cache(self) -> None:
+        self._carousel_messages: Dict[ItemCategory, List[TemplateMessage]] = {}
+        self._carousel_generation = (0, 0)
+
+    async def _get_carousel_messages(
+        self, category: ItemCategory
+    ) -> List[TemplateMessage]:
+        items = await menu_catalog.get_category(category)
+        # Rebuilt when the menu changes or item images finish resizing
+        generation = (menu_catalog.generation, image_store.generation)
+        if self._carousel_generation != generation:
+            self._carousel_messages.clear()
+            self._carousel_generation = generation
+        if category not in self._carousel_messages:
+            # Newest items first
+            self._carousel_messages[category] = build_carousel_messages(items[::-1])
+        return self._carousel_messages[category]
 
     @command
     async def order(
@@ -67,14 +184,8 @@ class OrderCog(Cog):
         is_continue_order: bool = False,
         item_category: Optional[str] = None,
     ) -> Any:
-        user = await User.get_or_none(id=ctx.user_id)
-        if user is None:
-            profile = await self.bot.line_bot_api.get_profile(ctx.user_id)
-            user = await User.create(
-                id=ctx.user_id,
-                name=profile.display_name,
-            )
-        if user.cart and not is_continue_order:
+        user = await self.bot.users.resolve(ctx.user_id)
+        if not is_continue_order and await CartLine.exists(user_id=user.id):
             template = ConfirmTemplate(
                 "系統偵測到你有尚未結帳的餐點, 是否要繼續點餐?",
                 actions=[
@@ -98,42 +209,11 @@ class OrderCog(Cog):
                 "請選擇餐點類別", quick_reply=QuickReply(quick_reply_items)
             )
 
-        all_items = await Item.all().filter(category=ItemCategory(item_category))
-        if not all_items:
+        messages = await self._get_carousel_messages(ItemCategory(item_category))
+        if not messages:
             return await ctx.reply_text(f"目前類別 {item_category} 沒有任何商品")
 
-        all_items.reverse()
-        split_items = split_list(all_items, 10)
-        templates: List[CarouselTemplate] = []
-        for items in split_items:
-            columns: List[CarouselColumn] = []
-            for item in items:
-                column = CarouselColumn(
-                    thumbnail_image_url=item.image_url
-                    or "https://i.ibb.co/h7sVKj2/Frame-5.png",
-                    title=item.name,
-                    text=f"{item.price} 元\n{item.description[:20]}",
-                    actions=[
-                        PostbackAction(
-                            label="點一份",
-                            data=f"cmd=confirm_order&item_id={item.id}&item_name={item.name}&item_price={item.price}&amount=1",
-                        ),
-                        PostbackAction(
-                            label="點兩份",
-                            data=f"cmd=confirm_order&item_id={item.id}&item_name={item.name}&item_price={item.price}&amount=2",
-                        ),
-                        PostbackAction(
-                            label="點三份",
-                            data=f"cmd=confirm_order&item_id={item.id}&item_name={item.name}&item_price={item.price}&amount=3",
-                        ),
-                    ],
-                )
-                columns.append(column)
-            templates.append(CarouselTemplate(columns=columns))
-
-        await ctx.reply_multiple(
-            [TemplateMessage("點餐", template=template) for template in templates]
-        )
+        await ctx.reply_multiple(messages)
 
     @command
     async def confirm_order(
@@ -155,28 +235,26 @@ class OrderCog(Cog):
 
     @command
     async def continue_order(self, ctx: Context) -> Any:
-        user = await User.get(id=ctx.user_id)
-        cart = await Cart().create(user.cart)
+        cart = await Cart().create(ctx.user_id)
         await ctx.reply_text(cart.display_text, quick_reply=cart.quick_reply)
 
     @command
     async def order_item(self, ctx: Context, item_id: int, amount: int) -> Any:
-        user = await User.get(id=ctx.user_id)
-        for _ in range(amount):
-            user.cart.append(item_id)
-        await user.save()
-
-        cart = await Cart().create(user.cart)
+        await Cart.add(ctx.user_id, item_id, amount)
+        cart = await Cart().create(ctx.user_id)
         await ctx.reply_text(cart.display_text, quick_reply=cart.quick_reply)
 
     @command
     async def checkout(self, ctx: Context) -> Any:
-        user = await User.get(id=ctx.user_id)
-        cart = await Cart().create(user.cart)
+        user = await self.bot.users.resolve(ctx.user_id)
+        cart = await Cart().create(user.id)
+        if not cart.items:
+            return await ctx.reply_text(cart.display_text, quick_reply=cart.quick_reply)
+        order = await cart.checkout(user.id)
         now_time_str = get_now().strftime("%Y-%m-%d %H:%M:%S")
-        await ctx.reply_text(f"{user.name}\n{now_time_str}\n\n{cart.display_text}")
-        user.cart.clear()
-        await user.save()
+        await ctx.reply_text(
+            f"{user.name}\n訂單編號: {order.id}\n{now_time_str}\n\n{cart.display_text}"
+        )
 
     @command
     async def remove_item(
@@ -186,9 +264,8 @@ class OrderCog(Cog):
         item_id: Optional[int] = None,
         amount: Optional[int] = None,
     ) -> Any:
-        user = await User.get(id=ctx.user_id)
         if item_id is None:
-            cart = await Cart().create(user.cart)
+            cart = await Cart().create(ctx.user_id)
             split_cart_items = split_list(cart.items, 11)
             quick_reply_items: List[QuickReplyItem] = []
             for item in split_cart_items[index]:
@@ -226,8 +303,8 @@ class OrderCog(Cog):
                 quick_reply=QuickReply(quick_reply_items),
             )
         else:
-            cart = await Cart().create(user.cart)
-            current_amount = user.cart.count(item_id)
+            cart = await Cart().create(ctx.user_id)
+            current_amount = cart.quantities.get(item_id, 0)
             delete_amount = amount or current_amount
 
             if delete_amount > current_amount:
@@ -247,9 +324,6 @@ class OrderCog(Cog):
                     ]
                 )
 
-            for _ in range(delete_amount):
-                user.cart.remove(item_id)
-            await user.save()
-
-            cart = await Cart().create(user.cart)
+            await Cart.remove(ctx.user_id, item_id, delete_amount)
+            cart = await Cart().create(ctx.user_id)
             await ctx.reply_text(cart.display_text, quick_reply=cart.quick_reply)
@@ -0,0 +1,132 @@
+import datetime
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Collection, List, Tuple
+
+from linebot.v3.webhooks import Event
+from tortoise.exceptions import IntegrityError
+
+from .intake import get_command_data, get_command_name, get_event_key
+from .models import ProcessedEvent
+
+
+class TTLKeySet:
+    """
+    Bounded set of keys that are forgotten `ttl` seconds after they were added
+    """
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires_at: OrderedDict[str, float] = OrderedDict()
+
+    def add(self, key: str) -> bool:
+        """
+        Add a key, returns False if it was already present
+        """
+        now = time.monotonic()
+        # Every key has the same ttl, so the oldest keys expire first
+        while self._expires_at:
+            oldest_key, expires_at = next(iter(self._expires_at.items()))
+            if expires_at > now and len(self._expires_at) < self.max_size:
+                break
+            del self._expires_at[oldest_key]
+
+        if key in self._expires_at:
+            return False
+        self._expires_at[key] = now + self.ttl
+        return True
+
+
+# Commands that change state, tapping them twice must not do it twice
+DOUBLE_TAP_COMMANDS = frozenset(
+    {"order_item", "checkout", "use_coupon", "give_points", "give_coupon"}
+)
+
+
+class EventDeduplicator:
+    """
+    Drops redelivered webhook events and double-tapped commands
+
+    Events are keyed by their webhook event id. Commands in `postback_commands`
+    are additionally keyed by the user and their postback data or message
+    text, so the same command sent twice in quick succession is only handled
+    once. give_points for example arrives as a text message filled in by
+    earn_points. Other commands, like paging or ordering again, may repeat.
+    The database mode shares the keys between workers.
+
+    Parameters:
+        event_ttl: Seconds an event id is remembered
+        postback_ttl: Seconds a user's command data is remembered
+        postback_commands: Commands whose repeats are dropped, empty to keep
+            every repeat
+        max_size: How many keys of each kind are kept in memory
+        use_database: Also record keys in the ProcessedEvent table
+    """
+
+    def __init__(
+        self,
+        *,
+        event_ttl: float = 600,
+        postback_ttl: float = 3,
+        postback_commands: Collection[str] = DOUBLE_TAP_COMMANDS,
+        max_size: int = 10000,
+        use_database: bool = False,
+    ) -> None:
+        self.postback_commands = postback_commands
+        self.use_database = use_database
+        self.duplicates = 0
+
+        self._events = TTLKeySet(event_ttl, max_size)
+        self._postbacks = TTLKeySet(postback_ttl, max_size)
+        self._checks_since_purge = 0
+
+    def _get_keys(self, event: Event) -> List[Tuple[TTLKeySet, str]]:
+        keys: List[Tuple[TTLKeySet, str]] = []
+        if event.webhook_event_id:
+            keys.append((self._events, f"event:{event.webhook_event_id}"))
+        data = get_command_data(event)
+        if data is not None and get_command_name(event) in self.postback_commands:
+            content = f"{get_event_key(event)}:{data}"
+            digest = hashlib.sha1(content.encode()).hexdigest()
+            keys.append((self._postbacks, f"postback:{digest}"))
+        return keys
+
+    async def _claim_in_database(self, key: str, ttl: float) -> bool:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expires_at = now + datetime.timedelta(seconds=ttl)
+        try:
+            await ProcessedEvent.create(key=key, expires_at=expires_at)
+        except IntegrityError:
+            # Only an expired key can be claimed again
+            return bool(
+                await ProcessedEvent.filter(key=key, expires_at__lt=now).update(
+                    expires_at=expires_at
+                )
+            )
+        return True
+
+    async def _purge_database(self) -> None:
+        self._checks_since_purge += 1
+        if self._checks_since_purge < 1000:
+            return
+        self._checks_since_purge = 0
+        await ProcessedEvent.filter(
+            expires_at__lt=datetime.datetime.now(datetime.timezone.utc)
+        ).delete()
+
+    async def is_duplicate(self, event: Event) -> bool:
+        for key_set, key in self._get_keys(event):
+            if not key_set.add(key):
+                self.duplicates += 1
+                return True
+            if self.use_database and not await self._claim_in_database(
+                key, key_set.ttl
+            ):
+                self.duplicates += 1
+                return True
+
+        if self.use_database:
+            await self._purge_database()
+        return False
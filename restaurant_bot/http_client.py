@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# LINE drops a request with the retry key of one it has already accepted
+RETRY_KEY_HEADER = "x-line-retry-key"
+
+
+class ResponseTooLargeError(aiohttp.ClientError):
+    """
+    The response body is larger than the request's `max_size`
+    """
+
+
+class CallStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency: float, *, error: bool = False) -> None:
+        self.count += 1
+        self.errors += error
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.count if self.count else 0.0
+
+
+class HTTPClient:
+    """
+    Long-lived HTTP client for outbound calls, with pooling, timeouts and retries
+
+    Parameters:
+        limit: Maximum number of open connections
+        limit_per_host: Maximum number of open connections per host
+        timeout: Total timeout of a single attempt in seconds
+        connect_timeout: Timeout for establishing a connection in seconds
+        max_retries: How many times a failed call is retried
+        backoff: Base delay in seconds, doubled on every retry
+    """
+
+    def __init__(
+        self,
+        *,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        timeout: float = 15,
+        connect_timeout: float = 5,
+        max_retries: int = 2,
+        backoff: float = 0.5,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats: Dict[str, CallStats] = defaultdict(CallStats)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise RuntimeError("HTTPClient.start must be called before making requests")
+        return self._session
+
+    async def start(self) -> None:
+        if self._session is not None:
+            return
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host
+            ),
+            timeout=self.timeout,
+        )
+
+    async def close(self) -> None:
+        if self._session is None:
+            return
+        await self._session.close()
+        self._session = None
+
+    async def request(
+        self,
+        name: str,
+        method: str,
+        url: str,
+        *,
+        max_size: Optional[int] = None,
+        **kwargs: Any,
+    ) -> bytes:
+        """
+        Send a request and return the response body, retrying failures with backoff
+
+        Only idempotent methods, and requests with an X-Line-Retry-Key header,
+        are retried. Any other request may have reached the server before it
+        failed, so sending it again could repeat it.
+
+        Parameters:
+            name: The name the call is recorded under in `stats`
+            method: The HTTP method
+            url: The URL
+            max_size: Refuse response bodies larger than this many bytes
+            kwargs: Passed to `aiohttp.ClientSession.request`
+        """
+        stats = self.stats[name]
+        can_retry = method.upper() in IDEMPOTENT_METHODS or any(
+            key.lower() == RETRY_KEY_HEADER for key in kwargs.get("headers") or {}
+        )
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                async with self.session.request(method, url, **kwargs) as resp:
+                    if max_size is None:
+                        body = await resp.read()
+                    else:
+                        body = await self._read_limited(resp, max_size)
+                    resp.raise_for_status()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                stats.record(time.perf_counter() - start, error=True)
+                retryable = (
+                    can_retry
+                    and not isinstance(e, ResponseTooLargeError)
+                    and (
+                        not isinstance(e, aiohttp.ClientResponseError)
+                        or e.status in RETRY_STATUSES
+                    )
+                )
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                logging.warning("%s failed: %s, retrying", name, e)
+                stats.retries += 1
+                await asyncio.sleep(self.backoff * 2**attempt)
+                attempt += 1
+            else:
+                stats.record(time.perf_counter() - start)
+                return body
+
+    @staticmethod
+    async def _read_limited(resp: aiohttp.ClientResponse, max_size: int) -> bytes:
+        # Content-Length can be missing or wrong, so the read is capped as well
+        if resp.content_length is not None and resp.content_length > max_size:
+            raise ResponseTooLargeError(
+                f"{resp.url} is {resp.content_length} bytes, over {max_size}"
+            )
+        body = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            body += chunk
+            if len(body) > max_size:
+                raise ResponseTooLargeError(f"{resp.url} is over {max_size} bytes")
+        return bytes(body)
+
+    async def request_json(
+        self, name: str, method: str, url: str, **kwargs: Any
+    ) -> Any:
+        return json.loads(await self.request(name, method, url, **kwargs))
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import io
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+from tortoise.exceptions import IntegrityError
+
+from .http_client import HTTPClient
+from .models import ImageVariant
+
+# Name: (width, height, format)
+VARIANTS: Dict[str, Tuple[int, int, str]] = {
+    # LINE templates only take JPEG and PNG, 1.51:1 is the carousel's default ratio
+    "carousel": (1024, 678, "JPEG"),
+    # The admin item card shows images at 400x170, rendered at twice the size
+    "card": (800, 340, "WEBP"),
+}
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+# Uploads are normalized to the carousel's size and ratio
+UPLOAD_SIZE = VARIANTS["carousel"][:2]
+# Larger source images are refused, the same limit as the web app's uploads
+MAX_SOURCE_SIZE = 20 * 1024 * 1024
+
+
+def normalize_upload(path: Path) -> bytes:
+    """
+    Crop an uploaded image to the carousel's ratio and compress it as JPEG
+    """
+    with Image.open(path) as source:
+        # Lets JPEG decode at a fraction of the size instead of the full resolution
+        source.draft("RGB", (UPLOAD_SIZE[0] * 2, UPLOAD_SIZE[1] * 2))
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    image = ImageOps.fit(image, UPLOAD_SIZE, Image.Resampling.LANCZOS)
+    bytes_io = io.BytesIO()
+    image.save(bytes_io, format="JPEG", quality=85, optimize=True)
+    return bytes_io.getvalue()
+
+
+def render_variants(data: bytes) -> Dict[str, Tuple[str, bytes]]:
+    """
+    Resize an image to every variant, returns the file extension and content of each
+    """
+    variants: Dict[str, Tuple[str, bytes]] = {}
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    for name, (width, height, image_format) in VARIANTS.items():
+        resized = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+        bytes_io = io.BytesIO()
+        resized.save(bytes_io, format=image_format, quality=80, optimize=True)
+        variants[name] = (EXTENSIONS[image_format], bytes_io.getvalue())
+    return variants
+
+
+class ImageStore:
+    """
+    Resized variants of item images, stored on disk under content-hash filenames
+
+    Every source image is fetched and resized once, the variants are recorded in
+    the ImageVariant table so the bot and the web app share them. Lookups are
+    answered from memory, sources without variants are processed in the
+    background and `generation` is incremented when they are ready.
+
+    Parameters:
+        directory: Where the variants are stored
+        retry_interval: Seconds before a source that failed to process is retried
+    """
+
+    def __init__(
+        self, directory: str = "data/images", *, retry_interval: float = 600
+    ) -> None:
+        self.directory = Path(directory)
+        self.retry_interval = retry_interval
+        self.public_url: Optional[str] = None
+        self.generation = 0
+
+        self._http_client: Optional[HTTPClient] = None
+        self._filenames: Dict[Tuple[str, str], str] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._processing: Dict[str, asyncio.Task[None]] = {}
+
+    @staticmethod
+    def get_source_digest(source_url: str) -> str:
+        return hashlib.sha256(source_url.encode()).hexdigest()[:32]
+
+    def path(self, filename: str) -> Path:
+        return self.directory / filename
+
+    async def start(self, http_client: HTTPClient, public_url: Optional[str]) -> None:
+        """
+        Load the known variants, call after Tortoise is initialized
+
+        Parameters:
+            http_client: Used to fetch source images
+            public_url: Where the bot serves the variants, None disables lookups
+        """
+        self._http_client = http_client
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for source, variant, filename in await ImageVariant.all().values_list(
+            "source", "variant", "filename"
+        ):
+            self._filenames[(source, variant)] = filename
+
+    def get_url(self, source_url: Optional[str], variant: str) -> Optional[str]:
+        """
+        The URL of a variant of source_url, schedules processing and returns None
+        if it isn't ready yet
+        """
+        if not source_url or self.public_url is None:
+            return None
+        filename = self._filenames.get((self.get_source_digest(source_url), variant))
+        if filename is None:
+            self.schedule(source_url)
+            return None
+        return f"{self.public_url}/restaurant/images/{filename}"
+
+    def schedule(self, source_url: str) -> None:
+        digest = self.get_source_digest(source_url)
+        if digest in self._processing:
+            return
+        failed_at = self._failed_at.get(digest)
+        if failed_at is not None and time.monotonic() - failed_at < self.retry_interval:
+            return
+        task = asyncio.create_task(self._process(digest, source_url))
+        self._processing[digest] = task
+        task.add_done_callback(lambda _: self._processing.pop(digest, None))
+
+    async def ensure(self, source_url: str) -> None:
+        """
+        Process source_url unless its variants exist, waits until they do
+        """
+        digest = self.get_source_digest(source_url)
+        if all((digest, variant) in self._filenames for variant in VARIANTS):
+            return
+        self._failed_at.pop(digest, None)
+        self.schedule(source_url)
+        await self._processing[digest]
+
+    def _write_file(self, content: bytes, extension: str) -> str:
+        filename = f"{hashlib.sha256(content).hexdigest()[:32]}.{extension}"
+        path = self.path(filename)
+        if not path.exists():
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(content)
+            tmp_path.replace(path)
+        return filename
+
+    def _write(self, data: bytes) -> Dict[str, str]:
+        return {
+            variant: self._write_file(content, extension)
+            for variant, (extension, content) in render_variants(data).items()
+        }
+
+    def _store_upload(self, path: Path) -> Tuple[str, Dict[str, str]]:
+        data = normalize_upload(path)
+        return self._write_file(data, "jpg"), self._write(data)
+
+    async def _record(self, digest: str, filenames: Dict[str, str]) -> None:
+        for variant, filename in filenames.items():
+            try:
+                await ImageVariant.update_or_create(
+                    source=digest, variant=variant, defaults={"filename": filename}
+                )
+            except IntegrityError:
+                # Raced with another process, its files are identical
+                pass
+
+    async def store_upload(self, path: Path) -> str:
+        """
+        Normalize and store an uploaded image, returns the URL it is served at
+
+        The upload is decoded and resized in a worker thread and deleted afterwards.
+        """
+        if self.public_url is None:
+            raise RuntimeError("PUBLIC_URL is required to serve uploaded images")
+        try:
+            filename, filenames = await asyncio.to_thread(self._store_upload, path)
+        finally:
+            path.unlink(missing_ok=True)
+        url = f"{self.public_url}/restaurant/images/{filename}"
+        # The variants are made from the upload, the bot never fetches the URL
+        digest = self.get_source_digest(url)
+        await self._record(digest, filenames)
+        for variant, variant_filename in filenames.items():
+            self._filenames[(digest, variant)] = variant_filename
+        self.generation += 1
+        return url
+
+    async def _process(self, digest: str, source_url: str) -> None:
+        try:
+            # Another process may have made the variants already
+            rows = await ImageVariant.filter(source=digest).values_list(
+                "variant", "filename"
+            )
+            filenames: Dict[str, str] = dict(rows)
+            if set(filenames) != set(VARIANTS):
+                if self._http_client is None:
+                    raise RuntimeError("ImageStore.start must be called first")
+                data = await self._http_client.request(
+                    "fetch_image", "GET", source_url, max_size=MAX_SOURCE_SIZE
+                )
+                filenames = await asyncio.to_thread(self._write, data)
+                await self._record(digest, filenames)
+        except Exception:
+            logging.exception("Failed to process image %s", source_url)
+            self._failed_at[digest] = time.monotonic()
+            return
+
+        for variant, filename in filenames.items():
+            self._filenames[(digest, variant)] = filename
+        self.generation += 1
+
+
+image_store = ImageStore()
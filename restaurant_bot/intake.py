@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from linebot.v3.webhooks import Event, MessageEvent, PostbackEvent, TextMessageContent
+
+Handler = Callable[[], Awaitable[None]]
+
+
+def get_event_key(event: Event) -> str:
+    """
+    Events with the same key are handled in order, one at a time
+    """
+    source = event.source
+    if source is None:
+        return ""
+    return getattr(source, "user_id", None) or ""
+
+
+def get_command_data(event: Event) -> Optional[str]:
+    """
+    The postback data or message text an event carries, commands are parsed from it
+    """
+    if isinstance(event, PostbackEvent):
+        return event.postback.data
+    if isinstance(event, MessageEvent) and isinstance(
+        event.message, TextMessageContent
+    ):
+        return event.message.text
+    return None
+
+
+def get_command_name(event: Event) -> str:
+    """
+    The command an event invokes
+    """
+    data = get_command_data(event)
+    if data is None:
+        return "other"
+    if not data.startswith("cmd="):
+        return "message" if isinstance(event, MessageEvent) else "other"
+    return data[4:].partition("&")[0]
+
+
+class EventQueue:
+    """
+    Bounded queue of webhook events, processed concurrently across users but
+    strictly in order for the same user
+
+    Parameters:
+        workers: How many events are handled at the same time
+        max_size: How many events can be pending, `put` waits when it is full
+    """
+
+    def __init__(self, *, workers: int = 16, max_size: int = 1000) -> None:
+        self.workers = workers
+        self.max_size = max_size
+        self.depth = 0
+        self.processed = 0
+        self.errors = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+        self._pending: Dict[str, Deque[Tuple[float, Handler]]] = {}
+        # Keys with pending events that no worker is handling yet
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        self._space = asyncio.Semaphore(max_size)
+        self._tasks: List[asyncio.Task[None]] = []
+        self._idle: Optional[asyncio.Event] = None
+
+    @property
+    def average_wait_time(self) -> float:
+        return self.total_wait_time / self.processed if self.processed else 0.0
+
+    async def put(self, key: str, handler: Handler) -> None:
+        await self._space.acquire()
+        self.depth += 1
+        if self._idle is not None:
+            self._idle.clear()
+
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = deque([(time.perf_counter(), handler)])
+            self._ready.put_nowait(key)
+        else:
+            # A worker already owns this key and picks the event up after the current one
+            pending.append((time.perf_counter(), handler))
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._pending[key]
+            enqueued_at, handler = pending.popleft()
+
+            wait_time = time.perf_counter() - enqueued_at
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            try:
+                await handler()
+            except Exception:
+                self.errors += 1
+                logging.exception("Failed to handle event")
+            finally:
+                self.processed += 1
+                self.depth -= 1
+                self._space.release()
+                if pending:
+                    # Requeue at the back so one busy user can't starve the others
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                if self.depth == 0 and self._idle is not None:
+                    self._idle.set()
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, *, timeout: float = 10) -> None:
+        """
+        Wait for pending events to be handled, then stop the workers
+        """
+        if not self._tasks:
+            return
+        assert self._idle
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Dropping %d unhandled events", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,281 @@
+import bisect
+import contextvars
+import functools
+import time
+from collections import Counter, defaultdict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+DB_METHODS = (
+    "execute_insert",
+    "execute_many",
+    "execute_query",
+    "execute_query_dict",
+    "execute_script",
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = buckets
+        # One count per bucket plus +Inf, not cumulative until rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class CommandRecord:
+    __slots__ = ("queries", "query_time")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.query_time = 0.0
+
+
+# The command being handled in the current task, queries are attributed to it
+_current_command: contextvars.ContextVar[
+    Optional[CommandRecord]
+] = contextvars.ContextVar("current_command", default=None)
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = (
+        key
+        + '="'
+        + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    """
+    Command, database and LINE API metrics of one process, in Prometheus text format
+
+    Parameters:
+        prefix: Prepended to every metric name
+        max_commands: Commands beyond this many are recorded as "other", the
+            command names come from user-controlled postback data
+    """
+
+    def __init__(
+        self, prefix: str = "restaurant_bot", *, max_commands: int = 100
+    ) -> None:
+        self.prefix = prefix
+        self.max_commands = max_commands
+        self.command_duration: Dict[str, Histogram] = defaultdict(
+            lambda: Histogram(LATENCY_BUCKETS)
+        )
+        self.command_queries: Dict[str, Histogram] = defaultdict(
+            lambda: Histogram(QUERY_COUNT_BUCKETS)
+        )
+        self.command_query_duration: Dict[str, Histogram] = defaultdict(
+            lambda: Histogram(LATENCY_BUCKETS)
+        )
+        self.command_errors: Counter[str] = Counter()
+        self.line_api_duration: Dict[str, Histogram] = defaultdict(
+            lambda: Histogram(LATENCY_BUCKETS)
+        )
+        self.line_api_errors: Counter[str] = Counter()
+        # Queries made outside of commands, by background jobs for example
+        self.background_query_duration = Histogram(LATENCY_BUCKETS)
+        # Name: (type, help, callback), the callback is read when rendering
+        self.callbacks: Dict[str, Tuple[str, str, Callable[[], float]]] = {}
+
+    async def track_command(
+        self, command: str, handler: Callable[[], Awaitable[None]]
+    ) -> None:
+        if (
+            command not in self.command_duration
+            and len(self.command_duration) >= self.max_commands
+        ):
+            command = "other"
+        record = CommandRecord()
+        token = _current_command.set(record)
+        start = time.perf_counter()
+        try:
+            await handler()
+        except Exception:
+            self.command_errors[command] += 1
+            raise
+        finally:
+            self.command_duration[command].observe(time.perf_counter() - start)
+            _current_command.reset(token)
+            self.command_queries[command].observe(record.queries)
+            self.command_query_duration[command].observe(record.query_time)
+
+    def _record_query(self, duration: float) -> None:
+        record = _current_command.get()
+        if record is None:
+            self.background_query_duration.observe(duration)
+        else:
+            record.queries += 1
+            record.query_time += duration
+
+    def _time_query(self, method: Callable[..., Awaitable[Any]]) -> Callable:
+        @functools.wraps(method)
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self._record_query(time.perf_counter() - start)
+
+        timed.__metrics_timed__ = True  # type: ignore
+        return timed
+
+    def instrument_database(self, client: BaseDBAsyncClient) -> None:
+        """
+        Time every query sent through the client's class and its transaction classes
+
+        The classes are patched, so this affects every client of the process
+        using them. Only processes that serve the metrics should call it.
+        """
+        client_class = type(client)
+        classes: List[Type[BaseDBAsyncClient]] = [client_class]
+        for cls in classes:
+            classes.extend(cls.__subclasses__())
+        for cls in classes:
+            for name in DB_METHODS:
+                # Subclasses inherit the timed method unless they override it
+                if cls is not client_class and name not in cls.__dict__:
+                    continue
+                method = getattr(cls, name)
+                if not getattr(method, "__metrics_timed__", False):
+                    setattr(cls, name, self._time_query(method))
+
+    def instrument_line_api(self, api_client: Any) -> None:
+        """
+        Time every call the LINE SDK client makes, by endpoint
+        """
+        call_api = api_client.call_api
+
+        async def timed(resource_path: str, method: str, *args: Any, **kwargs: Any):
+            start = time.perf_counter()
+            try:
+                return await call_api(resource_path, method, *args, **kwargs)
+            except Exception:
+                self.line_api_errors[resource_path] += 1
+                raise
+            finally:
+                self.line_api_duration[resource_path].observe(
+                    time.perf_counter() - start
+                )
+
+        api_client.call_api = timed
+
+    def _render_histograms(
+        self,
+        lines: List[str],
+        name: str,
+        help_text: str,
+        label: str,
+        histograms: Dict[str, Histogram],
+    ) -> None:
+        name = f"{self.prefix}_{name}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for value, histogram in list(histograms.items()):
+            labels = {label: value} if label else {}
+            cumulative = 0
+            for bucket, count in zip(
+                (*histogram.buckets, "+Inf"), histogram.counts, strict=True
+            ):
+                cumulative += count
+                bucket_labels = _format_labels({**labels, "le": str(bucket)})
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+    def _render_counter(
+        self,
+        lines: List[str],
+        name: str,
+        help_text: str,
+        label: str,
+        counter: Dict[str, int],
+    ) -> None:
+        name = f"{self.prefix}_{name}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for value, count in list(counter.items()):
+            lines.append(f"{name}{_format_labels({label: value})} {count}")
+
+    def render(self) -> str:
+        lines: List[str] = []
+        self._render_histograms(
+            lines,
+            "command_duration_seconds",
+            "Time spent handling a command",
+            "command",
+            self.command_duration,
+        )
+        self._render_histograms(
+            lines,
+            "command_queries",
+            "Database queries made while handling a command",
+            "command",
+            self.command_queries,
+        )
+        self._render_histograms(
+            lines,
+            "command_query_duration_seconds",
+            "Time spent in database queries while handling a command",
+            "command",
+            self.command_query_duration,
+        )
+        self._render_counter(
+            lines,
+            "command_errors_total",
+            "Commands that raised an error",
+            "command",
+            self.command_errors,
+        )
+        self._render_histograms(
+            lines,
+            "background_query_duration_seconds",
+            "Duration of database queries made outside of commands",
+            "",
+            {"": self.background_query_duration},
+        )
+        self._render_histograms(
+            lines,
+            "line_api_duration_seconds",
+            "Duration of LINE API calls",
+            "endpoint",
+            self.line_api_duration,
+        )
+        self._render_counter(
+            lines,
+            "line_api_errors_total",
+            "LINE API calls that failed",
+            "endpoint",
+            self.line_api_errors,
+        )
+        for callback_name, (kind, help_text, callback) in self.callbacks.items():
+            name = f"{self.prefix}_{callback_name}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {callback()}")
+        return "\n".join(lines) + "\n"
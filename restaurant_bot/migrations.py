@@ -0,0 +1,261 @@
+import asyncio
+import contextlib
+import logging
+import sys
+from collections import Counter
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Set, Tuple
+
+from tortoise import Tortoise
+from tortoise.exceptions import OperationalError
+from tortoise.transactions import in_transaction
+
+from .auth import hash_password, is_password_hash
+from .models import CartLine, Coupon, Item, SchemaMigration, User, UserCoupon
+
+# Arbitrary key for pg_advisory_lock, shared by every process using the database
+MIGRATION_LOCK_KEY = 7030_7031
+
+
+async def create_tables() -> None:
+    """
+    Create missing tables and indexes, existing tables are left untouched
+    """
+    await Tortoise.generate_schemas(safe=True)
+
+
+async def migrate_json_carts() -> None:
+    """
+    Move the legacy User.cart JSON lists into CartLine rows
+
+    Users whose cart has already been migrated have an empty list, so running
+    this again is a no-op.
+    """
+    carts = [
+        (user_id, cart)
+        for user_id, cart in await User.all().values_list("id", "cart")
+        if cart
+    ]
+    if not carts:
+        return
+
+    existing_item_ids = set(await Item.all().values_list("id", flat=True))
+    async with in_transaction():
+        for user_id, cart in carts:
+            for item_id, quantity in Counter(cart).items():
+                if item_id not in existing_item_ids:
+                    continue
+                line, created = await CartLine.get_or_create(
+                    user_id=user_id, item_id=item_id, defaults={"quantity": quantity}
+                )
+                if not created:
+                    line.quantity += quantity
+                    await line.save(update_fields=["quantity"])
+            await User.filter(id=user_id).update(cart=[])
+
+
+async def migrate_json_coupons() -> None:
+    """
+    Move the legacy User.coupon_ids JSON lists into UserCoupon rows
+
+    Users whose coupons have already been migrated have an empty list, so
+    running this again is a no-op.
+    """
+    wallets = [
+        (user_id, coupon_ids)
+        for user_id, coupon_ids in await User.all().values_list("id", "coupon_ids")
+        if coupon_ids
+    ]
+    if not wallets:
+        return
+
+    existing_coupon_ids = set(await Coupon.all().values_list("id", flat=True))
+    async with in_transaction():
+        for user_id, coupon_ids in wallets:
+            for coupon_id, quantity in Counter(coupon_ids).items():
+                if coupon_id not in existing_coupon_ids:
+                    continue
+                holding, created = await UserCoupon.get_or_create(
+                    user_id=user_id,
+                    coupon_id=coupon_id,
+                    defaults={"quantity": quantity},
+                )
+                if not created:
+                    holding.quantity += quantity
+                    await holding.save(update_fields=["quantity"])
+            await User.filter(id=user_id).update(coupon_ids=[])
+
+
+async def _get_columns(table: str) -> Set[str]:
+    client = Tortoise.get_connection("default")
+    if client.capabilities.dialect == "postgres":
+        _, rows = await client.execute_query(
+            "SELECT column_name FROM information_schema.columns"
+            " WHERE table_schema = current_schema() AND table_name = $1",
+            [table],
+        )
+        return {row["column_name"] for row in rows}
+    _, rows = await client.execute_query(f'PRAGMA table_info("{table}")')
+    return {row["name"] for row in rows}
+
+
+async def add_login_names() -> None:
+    """
+    Add User.login_name, filled with the names of admins, and hash plaintext passwords
+    """
+    client = Tortoise.get_connection("default")
+    # Checked so an attempt that failed halfway never blocks the next one
+    if "login_name" not in await _get_columns("user"):
+        await client.execute_query(
+            'ALTER TABLE "user" ADD COLUMN "login_name" VARCHAR(50)'
+        )
+    await client.execute_query(
+        'CREATE UNIQUE INDEX IF NOT EXISTS "uid_user_login_name"'
+        ' ON "user" ("login_name")'
+    )
+
+    admins = await User.filter(is_admin=True).values_list("id", "name")
+    name_counts = Counter(name for _, name in admins)
+    async with in_transaction():
+        for user_id, name in admins:
+            if name_counts[name] > 1 or len(name) > 50:
+                logging.warning("Admin %s needs a login name to be set by hand", name)
+                continue
+            await User.filter(id=user_id).update(login_name=name)
+
+        for user_id, password in await User.filter(password__isnull=False).values_list(
+            "id", "password"
+        ):
+            if not is_password_hash(password):
+                password_hash = await asyncio.to_thread(hash_password, password)
+                await User.filter(id=user_id).update(password=password_hash)
+
+
+# Append new migrations to the end, never reorder or remove applied ones
+MIGRATIONS: List[Tuple[str, Callable[[], Awaitable[None]]]] = [
+    ("create_tables", create_tables),
+    ("migrate_json_carts", migrate_json_carts),
+    ("migrate_json_coupons", migrate_json_coupons),
+    ("create_processed_event", create_tables),
+    ("create_orders", create_tables),
+    ("create_sales_rollups", create_tables),
+    ("create_image_variants", create_tables),
+    ("add_login_names", add_login_names),
+]
+LATEST_VERSION = len(MIGRATIONS)
+
+
+async def get_schema_version() -> int:
+    try:
+        migration = await SchemaMigration.all().order_by("-version").first()
+    except OperationalError:
+        # The migration table doesn't exist yet
+        return 0
+    return migration.version if migration else 0
+
+
+async def _is_empty_database() -> bool:
+    try:
+        await User.exists()
+    except OperationalError:
+        return True
+    return False
+
+
+@contextlib.asynccontextmanager
+async def migration_lock() -> AsyncIterator[None]:
+    """
+    Hold a lock so the bot and the web app never migrate at the same time
+    """
+    client: Any = Tortoise.get_connection("default")
+    if client.capabilities.dialect == "postgres":
+        import asyncpg
+
+        # A connection outside of the pool, the migrations need the pool's connections
+        connection = await asyncpg.connect(
+            host=client.host,
+            port=client.port,
+            user=client.user,
+            password=client.password,
+            database=client.database,
+            server_settings=client.server_settings,
+            ssl=client.extra.get("ssl"),
+        )
+        try:
+            # Released when the connection closes, even if unlocking fails
+            await connection.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+            yield
+        finally:
+            await connection.close()
+        return
+
+    filename = getattr(client, "filename", ":memory:")
+    if filename == ":memory:":
+        yield
+        return
+    with open(f"{filename}.migrate.lock", "w") as lock_file:
+        await asyncio.to_thread(_lock_file, lock_file.fileno())
+        try:
+            yield
+        finally:
+            _unlock_file(lock_file.fileno())
+
+
+def _lock_file(fd: int) -> None:
+    if sys.platform == "win32":
+        import msvcrt
+
+        while True:
+            try:
+                # Gives up after 10 attempts a second apart
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    else:
+        import fcntl
+
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def _unlock_file(fd: int) -> None:
+    if sys.platform == "win32":
+        import msvcrt
+
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+async def migrate() -> None:
+    """
+    Apply pending migrations, this is a single query when the schema is current
+    """
+    if await get_schema_version() >= LATEST_VERSION:
+        return
+
+    async with migration_lock():
+        # Another process may have migrated while we waited for the lock
+        version = await get_schema_version()
+        if version == 0 and await _is_empty_database():
+            # A new database gets the latest schema straight away
+            logging.info("Creating database schema")
+            async with in_transaction():
+                await create_tables()
+                await SchemaMigration.bulk_create(
+                    [
+                        SchemaMigration(version=version, name=name)
+                        for version, (name, _) in enumerate(MIGRATIONS, start=1)
+                    ]
+                )
+            return
+
+        for version, (name, migration) in enumerate(
+            MIGRATIONS[version:], start=version + 1
+        ):
+            logging.info("Applying migration %d: %s", version, name)
+            # A failed migration leaves no trace and is applied again on the next start
+            async with in_transaction():
+                await migration()
+                await SchemaMigration.create(version=version, name=name)
@@ -9,7 +9,7 @@ class Coupon(Model):
     id = fields.IntField(pk=True)
     name = fields.CharField(max_length=20)
     description = fields.CharField(max_length=50)
-    expire_date = fields.DateField()
+    expire_date = fields.DateField(index=True)
 
 
 class User(Model):
@@ -17,8 +17,12 @@ class User(Model):
     name = fields.CharField(max_length=255)
     points = fields.IntField(default=0, min_value=0)
     is_admin = fields.BooleanField(default=False)
+    # Admins log in to the web app with a login name and an scrypt password hash
+    login_name = fields.CharField(max_length=50, null=True, default=None, unique=True)
     password = fields.CharField(max_length=255, null=True, default=None)
+    # Legacy per-unit cart, superseded by CartLine and emptied by the migration
     cart: List[int] = fields.JSONField(default=[])  # type: ignore
+    # Legacy per-copy coupon list, superseded by UserCoupon and emptied by the migration
     coupon_ids: List[int] = fields.JSONField(default=[])  # type: ignore
 
 
@@ -36,3 +40,133 @@ class Item(Model):
     category = fields.CharEnumField(ItemCategory, max_length=20)
     price = fields.IntField(min_value=0)
     image_url: Optional[str] = fields.CharField(max_length=255, null=True, default=None)  # type: ignore
+
+
+class CartLine(Model):
+    id = fields.IntField(pk=True)
+    user: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
+        "models.User", related_name="cart_lines", on_delete=fields.CASCADE
+    )
+    item: fields.ForeignKeyRelation[Item] = fields.ForeignKeyField(
+        "models.Item", related_name="cart_lines", on_delete=fields.CASCADE
+    )
+    quantity = fields.IntField(default=0, min_value=0)
+
+    class Meta:
+        unique_together = (("user", "item"),)
+
+
+class UserCoupon(Model):
+    id = fields.IntField(pk=True)
+    # Lookups by user are covered by the unique (user, coupon) index
+    user: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
+        "models.User", related_name="coupons", on_delete=fields.CASCADE
+    )
+    coupon: fields.ForeignKeyRelation[Coupon] = fields.ForeignKeyField(
+        "models.Coupon", related_name="holdings", on_delete=fields.CASCADE, index=True
+    )
+    quantity = fields.IntField(default=0, min_value=0)
+    issued_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (("user", "coupon"),)
+
+
+class PointTransaction(Model):
+    id = fields.IntField(pk=True)
+    user: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
+        "models.User", related_name="point_transactions", on_delete=fields.CASCADE
+    )
+    delta = fields.IntField()
+    reason = fields.CharField(max_length=50)
+    operator: fields.ForeignKeyNullableRelation[User] = fields.ForeignKeyField(
+        "models.User",
+        related_name="operated_point_transactions",
+        on_delete=fields.SET_NULL,
+        null=True,
+    )
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = (("user_id", "created_at"),)
+
+
+class Order(Model):
+    id = fields.IntField(pk=True)
+    user: fields.ForeignKeyNullableRelation[User] = fields.ForeignKeyField(
+        "models.User", related_name="orders", on_delete=fields.SET_NULL, null=True
+    )
+    total_price = fields.IntField(min_value=0)
+    created_at = fields.DatetimeField(auto_now_add=True, index=True)
+
+
+class OrderLine(Model):
+    id = fields.IntField(pk=True)
+    order: fields.ForeignKeyRelation[Order] = fields.ForeignKeyField(
+        "models.Order", related_name="lines", on_delete=fields.CASCADE
+    )
+    # Name and price are snapshots, the item may be edited or deleted later
+    item: fields.ForeignKeyNullableRelation[Item] = fields.ForeignKeyField(
+        "models.Item", related_name="order_lines", on_delete=fields.SET_NULL, null=True
+    )
+    item_name = fields.CharField(max_length=20)
+    unit_price = fields.IntField(min_value=0)
+    quantity = fields.IntField(min_value=1)
+    created_date = fields.DateField()
+
+    class Meta:
+        indexes = (("created_date", "item_id"),)
+
+
+class DailySales(Model):
+    date = fields.DateField(pk=True)
+    revenue = fields.IntField(default=0)
+    order_count = fields.IntField(default=0)
+
+
+class DailyItemSales(Model):
+    id = fields.IntField(pk=True)
+    date = fields.DateField()
+    item_name = fields.CharField(max_length=20)
+    quantity = fields.IntField(default=0)
+    revenue = fields.IntField(default=0)
+
+    class Meta:
+        unique_together = (("date", "item_name"),)
+
+
+class HourlyOrders(Model):
+    id = fields.IntField(pk=True)
+    date = fields.DateField()
+    hour = fields.IntField()
+    order_count = fields.IntField(default=0)
+
+    class Meta:
+        unique_together = (("date", "hour"),)
+
+
+class ImageVariant(Model):
+    id = fields.IntField(pk=True)
+    # Digest of the source image URL
+    source = fields.CharField(max_length=32)
+    variant = fields.CharField(max_length=20)
+    filename = fields.CharField(max_length=40)
+
+    class Meta:
+        unique_together = (("source", "variant"),)
+
+
+class Setting(Model):
+    key = fields.CharField(pk=True, max_length=50)
+    value = fields.TextField()
+
+
+class ProcessedEvent(Model):
+    key = fields.CharField(pk=True, max_length=64)
+    expires_at = fields.DatetimeField(index=True)
+
+
+class SchemaMigration(Model):
+    version = fields.IntField(pk=True)
+    name = fields.CharField(max_length=50)
+    applied_at = fields.DatetimeField(auto_now_add=True)
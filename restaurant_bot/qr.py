@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import io
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+import qrcode
+
+
+def render_qr_code(data: str) -> bytes:
+    bytes_io = io.BytesIO()
+    qrcode.make(data).save(bytes_io, format="PNG")
+    return bytes_io.getvalue()
+
+
+class QRCodeCache:
+    """
+    Content-addressed QR code PNGs stored on disk with LRU eviction
+
+    Parameters:
+        directory: Where the rendered PNGs are stored
+        max_files: How many PNGs are kept on disk
+        max_memory_files: How many PNGs are also kept in memory
+    """
+
+    def __init__(
+        self,
+        directory: str = "data/qr",
+        *,
+        max_files: int = 2048,
+        max_memory_files: int = 128,
+    ) -> None:
+        self.directory = Path(directory)
+        self.max_files = max_files
+        self.max_memory_files = max_memory_files
+
+        self._files: OrderedDict[str, None] = OrderedDict()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._rendering: Dict[str, asyncio.Task[None]] = {}
+
+    @staticmethod
+    def get_digest(data: str) -> str:
+        return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / f"{digest}.png"
+
+    def load(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        paths = sorted(self.directory.glob("*.png"), key=lambda p: p.stat().st_mtime)
+        for path in paths:
+            self._files[path.stem] = None
+        self._evict()
+
+    def _remember(self, digest: str, png: bytes) -> None:
+        self._memory[digest] = png
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.max_memory_files:
+            self._memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        while len(self._files) > self.max_files:
+            digest, _ = self._files.popitem(last=False)
+            self._memory.pop(digest, None)
+            self._path(digest).unlink(missing_ok=True)
+
+    def _write(self, digest: str, data: str) -> bytes:
+        png = render_qr_code(data)
+        tmp_path = self._path(digest).with_suffix(".tmp")
+        tmp_path.write_bytes(png)
+        tmp_path.replace(self._path(digest))
+        return png
+
+    async def ensure(self, data: str) -> str:
+        """
+        Render the QR code for data unless it is already cached, returns its digest
+        """
+        digest = self.get_digest(data)
+        if digest in self._files:
+            # The file may have been removed by another worker evicting it, the
+            # image URL has to keep working so it is rendered again
+            if self._path(digest).exists():
+                self._files.move_to_end(digest)
+                return digest
+            del self._files[digest]
+
+        # Coalesce concurrent taps for the same QR code into one render
+        task = self._rendering.get(digest)
+        if task is None:
+            task = asyncio.create_task(self._render(digest, data))
+            self._rendering[digest] = task
+            task.add_done_callback(lambda _: self._rendering.pop(digest, None))
+        await task
+        return digest
+
+    async def _render(self, digest: str, data: str) -> None:
+        png = await asyncio.to_thread(self._write, digest, data)
+        self._files[digest] = None
+        self._remember(digest, png)
+        self._evict()
+
+    async def read(self, digest: str) -> Optional[bytes]:
+        png = self._memory.get(digest)
+        if png is None:
+            # Other workers share the directory, so a QR code rendered by one of
+            # them is on disk without being known here
+            try:
+                png = await asyncio.to_thread(self._path(digest).read_bytes)
+            except FileNotFoundError:
+                self._files.pop(digest, None)
+                return None
+            self._remember(digest, png)
+        self._files[digest] = None
+        self._files.move_to_end(digest)
+        self._evict()
+        return png
@@ -0,0 +1,181 @@
+import datetime
+import logging
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import F
+from tortoise.functions import Sum
+from tortoise.models import Model
+from tortoise.transactions import in_transaction
+
+from .models import DailyItemSales, DailySales, HourlyOrders, Order, Setting
+from .tasks import PeriodicJob
+from .utils import get_now, get_today
+
+WATERMARK_KEY = "sales_rollup_watermark"
+# Order ids are assigned before the checkout commits, so the newest orders are
+# left alone until slower checkouts with smaller ids have had time to commit
+SETTLE_DELAY = datetime.timedelta(seconds=30)
+
+
+async def _increment(model: Type[Model], keys: Dict[str, Any], **deltas: int) -> None:
+    updates = {name: F(name) + delta for name, delta in deltas.items()}
+    if not await model.filter(**keys).update(**updates):
+        await model.create(**keys, **deltas)
+
+
+async def _advance_watermark(watermark: Optional[str], new_watermark: int) -> bool:
+    """
+    Compare-and-set the watermark, fails if another process moved it first
+    """
+    if watermark is None:
+        try:
+            await Setting.create(key=WATERMARK_KEY, value=str(new_watermark))
+        except IntegrityError:
+            return False
+        return True
+    return bool(
+        await Setting.filter(key=WATERMARK_KEY, value=watermark).update(
+            value=str(new_watermark)
+        )
+    )
+
+
+async def update_sales_rollups(*, batch_size: int = 500) -> int:
+    """
+    Fold orders placed since the last run into the daily rollup tables
+
+    Returns the number of orders processed.
+    """
+    tz = get_now().tzinfo
+    processed = 0
+    while True:
+        setting = await Setting.get_or_none(key=WATERMARK_KEY)
+        watermark = setting.value if setting else None
+        # Stored timestamps are UTC, SQLite compares them as text
+        settled_before = datetime.datetime.now(datetime.timezone.utc) - SETTLE_DELAY
+        orders = (
+            await Order.filter(
+                id__gt=int(watermark or 0), created_at__lt=settled_before
+            )
+            .order_by("id")
+            .limit(batch_size)
+            .prefetch_related("lines")
+        )
+        if not orders:
+            return processed
+
+        revenue: Counter[datetime.date] = Counter()
+        order_counts: Counter[datetime.date] = Counter()
+        hourly_counts: Counter[Tuple[datetime.date, int]] = Counter()
+        item_sales: Dict[Tuple[datetime.date, str], List[int]] = defaultdict(
+            lambda: [0, 0]
+        )
+        for order in orders:
+            created_at = order.created_at.astimezone(tz)
+            date = created_at.date()
+            revenue[date] += order.total_price
+            order_counts[date] += 1
+            hourly_counts[(date, created_at.hour)] += 1
+            for line in order.lines:
+                sales = item_sales[(date, line.item_name)]
+                sales[0] += line.quantity
+                sales[1] += line.quantity * line.unit_price
+
+        async with in_transaction():
+            # Moving the watermark first makes a concurrent run back off
+            # before it counts any of these orders again
+            if not await _advance_watermark(watermark, orders[-1].id):
+                logging.info("Sales rollup is already being updated elsewhere")
+                return processed
+            for date, count in order_counts.items():
+                await _increment(
+                    DailySales,
+                    {"date": date},
+                    revenue=revenue[date],
+                    order_count=count,
+                )
+            for (date, hour), count in hourly_counts.items():
+                await _increment(
+                    HourlyOrders, {"date": date, "hour": hour}, order_count=count
+                )
+            for (date, item_name), (quantity, item_revenue) in item_sales.items():
+                await _increment(
+                    DailyItemSales,
+                    {"date": date, "item_name": item_name},
+                    quantity=quantity,
+                    revenue=item_revenue,
+                )
+        processed += len(orders)
+
+
+class SalesReport:
+    def __init__(
+        self,
+        daily_sales: List[DailySales],
+        top_items: List[Dict[str, Any]],
+        orders_per_hour: Dict[int, int],
+    ) -> None:
+        self.daily_sales = daily_sales
+        self.top_items = top_items
+        self.orders_per_hour = orders_per_hour
+
+    @property
+    def revenue(self) -> int:
+        return sum(day.revenue for day in self.daily_sales)
+
+    @property
+    def order_count(self) -> int:
+        return sum(day.order_count for day in self.daily_sales)
+
+
+async def get_sales_report(*, days: int = 30, top_items: int = 10) -> SalesReport:
+    """
+    Read the sales of the last `days` days from the rollup tables
+
+    Parameters:
+        days: How many days to include, today included
+        top_items: How many of the best selling items to include
+    """
+    since = get_today() - datetime.timedelta(days=days - 1)
+    daily_sales = await DailySales.filter(date__gte=since).order_by("date")
+    items = (
+        await DailyItemSales.filter(date__gte=since)
+        .annotate(total_quantity=Sum("quantity"), total_revenue=Sum("revenue"))
+        .group_by("item_name")
+        .order_by("-total_quantity")
+        .limit(top_items)
+        .values("item_name", "total_quantity", "total_revenue")
+    )
+    hours = (
+        await HourlyOrders.filter(date__gte=since)
+        .annotate(total=Sum("order_count"))
+        .group_by("hour")
+        .values_list("hour", "total")
+    )
+    orders_per_hour = {hour: 0 for hour in range(24)}
+    orders_per_hour.update({hour: int(total) for hour, total in hours})
+    return SalesReport(daily_sales, items, orders_per_hour)
+
+
+class SalesRollupJob(PeriodicJob):
+    """
+    Periodically folds new orders into the sales rollup tables
+
+    Parameters:
+        interval: Seconds between updates
+        batch_size: How many orders are read per query
+    """
+
+    name = "Sales rollup"
+
+    def __init__(self, *, interval: float = 300, batch_size: int = 500) -> None:
+        super().__init__(interval=interval)
+        self.batch_size = batch_size
+        self.last_orders_processed = 0
+
+    async def run_once(self) -> None:
+        self.last_orders_processed = await update_sales_rollups(
+            batch_size=self.batch_size
+        )
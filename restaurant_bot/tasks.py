@@ -0,0 +1,210 @@
+import abc
+import asyncio
+import logging
+import time
+from typing import Generic, List, Optional, Type, TypeVar
+
+from tortoise.models import Model
+
+from .models import UserCoupon
+from .utils import get_today
+
+MODEL = TypeVar("MODEL", bound=Model)
+
+
+class BatchWriter(Generic[MODEL]):
+    """
+    Buffers model instances and writes them with bulk_create in the background
+
+    A batch that fails is retried on the next flushes. Once it has failed
+    `max_attempts` times its rows are written one by one, and rows that still
+    fail are logged and dropped so they never hold up later batches.
+
+    Parameters:
+        model: The model of the buffered instances
+        max_batch_size: Flush as soon as this many instances are buffered
+        flush_interval: Seconds between flushes of a partial batch
+        max_attempts: How many times a batch is tried before it is written row by row
+    """
+
+    def __init__(
+        self,
+        model: Type[MODEL],
+        *,
+        max_batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_attempts: int = 3,
+    ) -> None:
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.written = 0
+        self.failures = 0
+        self.dropped = 0
+
+        self._pending: List[MODEL] = []
+        self._failed_attempts = 0
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def add(self, instance: MODEL) -> None:
+        self._pending.append(instance)
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+
+    async def _write_each(self, batch: List[MODEL]) -> None:
+        for instance in batch:
+            try:
+                await instance.save()
+            except Exception:
+                self.dropped += 1
+                logging.exception("Dropped %s %r", self.model.__name__, dict(instance))
+            else:
+                self.written += 1
+
+    async def flush(self, *, retry: bool = True) -> None:
+        """
+        Write the buffered instances
+
+        Parameters:
+            retry: Whether a failed batch is kept for the next flush, raising its
+                error, until it has failed `max_attempts` times
+        """
+        while self._pending:
+            batch = self._pending[: self.max_batch_size]
+            del self._pending[: self.max_batch_size]
+            try:
+                await self.model.bulk_create(batch)
+            except Exception:
+                self.failures += 1
+                self._failed_attempts += 1
+                if retry and self._failed_attempts < self.max_attempts:
+                    # Keep the batch so the next flush retries it
+                    self._pending[:0] = batch
+                    raise
+                logging.exception(
+                    "Failed to write %s batch, writing it row by row",
+                    self.model.__name__,
+                )
+                await self._write_each(batch)
+            else:
+                self.written += len(batch)
+            self._failed_attempts = 0
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Failed to write %s batch", self.model.__name__)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the background task and write what is left, never raises
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(retry=False)
+
+
+class PeriodicJob(abc.ABC):
+    """
+    Runs `run_once` every `interval` seconds in a background task
+
+    Parameters:
+        interval: Seconds between runs
+    """
+
+    name = "Periodic job"
+
+    def __init__(self, *, interval: float) -> None:
+        self.interval = interval
+        self.runs = 0
+        self.last_run_duration = 0.0
+        self._task: Optional[asyncio.Task[None]] = None
+
+    @abc.abstractmethod
+    async def run_once(self) -> None:
+        ...
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            try:
+                await self.run_once()
+            except Exception:
+                logging.exception("%s failed", self.name)
+            self.runs += 1
+            self.last_run_duration = time.perf_counter() - start
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+class CouponExpirySweeper(PeriodicJob):
+    """
+    Periodically removes holdings of expired coupons from users' wallets
+
+    Parameters:
+        interval: Seconds between sweeps
+        batch_size: How many holdings are deleted per statement
+    """
+
+    name = "Coupon expiry sweep"
+
+    def __init__(self, *, interval: float = 3600, batch_size: int = 500) -> None:
+        super().__init__(interval=interval)
+        self.batch_size = batch_size
+        self.last_rows_removed = 0
+        self.total_rows_removed = 0
+
+    async def run_once(self) -> None:
+        start = time.perf_counter()
+        today = get_today()
+        rows_removed = 0
+        while True:
+            holding_ids = (
+                await UserCoupon.filter(coupon__expire_date__lt=today)
+                .limit(self.batch_size)
+                .values_list("id", flat=True)
+            )
+            if not holding_ids:
+                break
+            rows_removed += await UserCoupon.filter(id__in=holding_ids).delete()
+            # Let command handlers run between batches
+            await asyncio.sleep(0)
+
+        self.last_rows_removed = rows_removed
+        self.total_rows_removed += rows_removed
+        logging.info(
+            "Removed %d expired coupon holdings in %.3fs",
+            rows_removed,
+            time.perf_counter() - start,
+        )
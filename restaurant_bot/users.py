@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from linebot.v3.messaging import AsyncMessagingApi
+from tortoise.signals import Signals
+
+from .models import User
+
+
+class UserResolver:
+    """
+    Per-process TTL/LRU cache of User rows
+
+    Entries are dropped whenever a User is saved or deleted in this process,
+    the TTL bounds how stale a row changed by another process can get. Other
+    workers may change points and the admin flag at any time, so handlers that
+    check or change them pass `fresh=True` to read the row from the database.
+
+    Parameters:
+        line_bot_api: Used to fetch the display name of new users
+        ttl: How long a cached user is served in seconds
+        max_size: How many users are cached
+    """
+
+    def __init__(
+        self, line_bot_api: AsyncMessagingApi, *, ttl: float = 30, max_size: int = 4096
+    ) -> None:
+        self.line_bot_api = line_bot_api
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._cache: OrderedDict[str, Tuple[float, User]] = OrderedDict()
+        self._profile_fetches: Dict[str, asyncio.Task[str]] = {}
+
+        User.register_listener(Signals.post_save, self._on_user_changed)
+        User.register_listener(Signals.post_delete, self._on_user_changed)
+
+    async def _on_user_changed(self, _: Any, instance: User, *args: Any) -> None:
+        self.invalidate(instance.id)
+
+    def invalidate(self, user_id: str) -> None:
+        self._cache.pop(user_id, None)
+
+    def _get_cached(self, user_id: str) -> Optional[User]:
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._cache[user_id]
+            return None
+        self._cache.move_to_end(user_id)
+        return user
+
+    def _store(self, user: User) -> None:
+        self._cache[user.id] = (time.monotonic() + self.ttl, user)
+        self._cache.move_to_end(user.id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def get(self, user_id: str, *, fresh: bool = False) -> Optional[User]:
+        user = None if fresh else self._get_cached(user_id)
+        if user is not None:
+            self.hits += 1
+            return user
+
+        self.misses += 1
+        user = await User.get_or_none(id=user_id)
+        if user is None:
+            self.invalidate(user_id)
+        else:
+            self._store(user)
+        return user
+
+    async def get_many(
+        self, user_ids: Iterable[str], *, fresh: bool = False
+    ) -> Dict[str, User]:
+        """
+        Get multiple users with at most one query, missing users are left out
+        """
+        users: Dict[str, User] = {}
+        missing_ids = []
+        for user_id in user_ids:
+            user = None if fresh else self._get_cached(user_id)
+            if user is None:
+                missing_ids.append(user_id)
+            else:
+                self.hits += 1
+                users[user_id] = user
+
+        if missing_ids:
+            self.misses += len(missing_ids)
+            for user in await User.filter(id__in=missing_ids):
+                self._store(user)
+                users[user.id] = user
+        return users
+
+    async def _fetch_display_name(self, user_id: str) -> str:
+        # Coalesce concurrent profile fetches for the same user into one call
+        task = self._profile_fetches.get(user_id)
+        if task is None:
+
+            async def fetch() -> str:
+                profile = await self.line_bot_api.get_profile(user_id)
+                return profile.display_name
+
+            task = asyncio.create_task(fetch())
+            self._profile_fetches[user_id] = task
+            task.add_done_callback(lambda _: self._profile_fetches.pop(user_id, None))
+        return await task
+
+    async def resolve(self, user_id: str, *, fresh: bool = False) -> User:
+        """
+        Get a user, creating it from the LINE profile if it doesn't exist
+        """
+        user = await self.get(user_id, fresh=fresh)
+        if user is not None:
+            return user
+
+        name = await self._fetch_display_name(user_id)
+        user, _ = await User.get_or_create(id=user_id, defaults={"name": name})
+        self._store(user)
+        return user
@@ -3,3 +3,5 @@ from .coupon_form import *
 from .item_card import *
 from .item_form import *
 from .login_form import *
+from .paged_list import *
+from .sales_report import *
@@ -2,21 +2,24 @@ import flet as ft
 
 from ..models import Coupon
 from .coupon_form import CouponForm
+from .paged_list import PagedList
 
 
 class CouponCard(ft.UserControl):
-    def __init__(self, coupon: Coupon):
+    def __init__(self, coupon: Coupon, coupons: PagedList[Coupon]):
         super().__init__()
         self.coupon = coupon
+        self.coupons = coupons
         self.dialog = ft.Ref[ft.AlertDialog]()
 
     async def edit_item(self, e: ft.ControlEvent):
         page: ft.Page = e.page
         page.views.append(
-            ft.View(controls=[CouponForm(is_create=False, coupon=self.coupon)])
+            ft.View(
+                controls=[CouponForm(self.coupons, is_create=False, coupon=self.coupon)]
+            )
         )
         await page.update_async()
-        await page.go_async("/coupon/refresh")
 
     async def delete_item(self, e: ft.ControlEvent):
         page: ft.Page = e.page
@@ -42,8 +45,8 @@ class CouponCard(ft.UserControl):
     async def dialog_delete(self, e: ft.ControlEvent):
         await Coupon.filter(id=self.coupon.id).delete()
         self.dialog.current.open = False
+        await self.coupons.remove(self.coupon.id)
         await e.page.update_async()
-        await e.page.go_async("/coupons/refresh")
 
     def build(self):
         return ft.Card(
@@ -5,11 +5,19 @@ import flet as ft
 
 from ..models import Coupon
 from ..utils import get_now
+from .paged_list import PagedList
 
 
 class CouponForm(ft.UserControl):
-    def __init__(self, *, is_create: bool = True, coupon: Optional[Coupon] = None):
+    def __init__(
+        self,
+        coupons: PagedList[Coupon],
+        *,
+        is_create: bool = True,
+        coupon: Optional[Coupon] = None,
+    ):
         super().__init__()
+        self.coupons = coupons
         self.name = ft.Ref[ft.TextField]()
         self.description = ft.Ref[ft.TextField]()
         self.expire_date = ft.Ref[ft.TextField]()
@@ -53,23 +61,20 @@ class CouponForm(ft.UserControl):
             await expire_date.update_async()
             return
 
+        fields = {
+            "name": name.value,
+            "description": description.value,
+            "expire_date": converted_expire_date,
+        }
         if self.is_create:
-            await Coupon.create(
-                name=name.value,
-                description=description.value,
-                expire_date=converted_expire_date,
-            )
+            self.coupons.insert(await Coupon.create(**fields))
         else:
             assert self.coupon
-            await Coupon.filter(id=self.coupon.id).update(
-                name=name.value,
-                description=description.value,
-                expire_date=converted_expire_date,
-            )
+            await Coupon.filter(id=self.coupon.id).update(**fields)
+            self.coupons.replace(self.coupon.update_from_dict(fields))
 
         e.page.views.pop()
         await e.page.update_async()
-        await e.page.go_async("/coupons/refresh")
 
     def build(self):
         return ft.SafeArea(
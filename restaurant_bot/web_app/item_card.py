@@ -1,20 +1,25 @@
 import flet as ft
 
+from ..catalog import menu_catalog
+from ..images import image_store
 from ..models import Item
 from .item_form import ItemForm
+from .paged_list import PagedList
 
 
 class ItemCard(ft.UserControl):
-    def __init__(self, item: Item):
+    def __init__(self, item: Item, items: PagedList[Item]):
         super().__init__()
         self.item = item
+        self.items = items
         self.dialog = ft.Ref[ft.AlertDialog]()
 
     async def edit_item(self, e: ft.ControlEvent):
         page: ft.Page = e.page
-        page.views.append(ft.View(controls=[ItemForm(is_create=False, item=self.item)]))
+        page.views.append(
+            ft.View(controls=[ItemForm(self.items, is_create=False, item=self.item)])
+        )
         await page.update_async()
-        await page.go_async("/items/refresh")
 
     async def delete_item(self, e: ft.ControlEvent):
         page: ft.Page = e.page
@@ -39,16 +44,18 @@ class ItemCard(ft.UserControl):
 
     async def dialog_delete(self, e: ft.ControlEvent):
         await Item.filter(id=self.item.id).delete()
+        await menu_catalog.bump_version()
         self.dialog.current.open = False
+        await self.items.remove(self.item.id)
         await e.page.update_async()
-        await e.page.go_async("/items/refresh")
 
     def build(self):
         return ft.Card(
             ft.Column(
                 [
                     ft.Image(
-                        src=self.item.image_url
+                        src=image_store.get_url(self.item.image_url, "card")
+                        or self.item.image_url
                         or "https://i.ibb.co/h7sVKj2/Frame-5.png",
                         border_radius=ft.border_radius.all(12),
                         fit=ft.ImageFit.COVER,
@@ -1,21 +1,95 @@
+import uuid
+from pathlib import Path
 from typing import Optional
 
 import flet as ft
 
+from ..catalog import menu_catalog
+from ..images import image_store
 from ..models import Item, ItemCategory
+from .paged_list import PagedList
+
+# Flet streams uploads into this directory, run_web_app.py passes it to ft.app
+UPLOAD_DIRECTORY = Path("data/uploads").resolve()
+MAX_UPLOAD_SIZE = 20 * 1024 * 1024
 
 
 class ItemForm(ft.UserControl):
-    def __init__(self, *, is_create: bool = True, item: Optional[Item] = None) -> None:
+    def __init__(
+        self,
+        items: PagedList[Item],
+        *,
+        is_create: bool = True,
+        item: Optional[Item] = None,
+    ) -> None:
         super().__init__()
+        self.items = items
         self.name = ft.Ref[ft.TextField]()
         self.description = ft.Ref[ft.TextField]()
         self.category = ft.Ref[ft.Dropdown]()
         self.price = ft.Ref[ft.TextField]()
         self.image_url = ft.Ref[ft.TextField]()
+        self.file_picker = ft.FilePicker(
+            on_result=self.upload_image, on_upload=self.store_image
+        )
 
         self.is_create = is_create
         self.item = item
+        self._upload_name: Optional[str] = None
+
+    async def did_mount_async(self):
+        self.page.overlay.append(self.file_picker)
+        await self.page.update_async()
+
+    async def will_unmount_async(self):
+        self.page.overlay.remove(self.file_picker)
+        await self.page.update_async()
+
+    async def pick_image(self, _: ft.ControlEvent) -> None:
+        await self.file_picker.pick_files_async(file_type=ft.FilePickerFileType.IMAGE)
+
+    async def upload_image(self, e: ft.FilePickerResultEvent) -> None:
+        if not e.files:
+            return
+        file = e.files[0]
+        image_url = self.image_url.current
+        if file.size > MAX_UPLOAD_SIZE:
+            image_url.error_text = "圖片不能超過 20 MB"
+            await image_url.update_async()
+            return
+
+        # A random name so concurrent uploads of the same file don't collide
+        self._upload_name = f"{uuid.uuid4().hex}{Path(file.name).suffix}"
+        image_url.error_text = None
+        image_url.helper_text = "上傳中..."
+        await image_url.update_async()
+        await self.file_picker.upload_async(
+            [
+                ft.FilePickerUploadFile(
+                    file.name,
+                    upload_url=self.page.get_upload_url(self._upload_name, 600),
+                )
+            ]
+        )
+
+    async def store_image(self, e: ft.FilePickerUploadEvent) -> None:
+        if self._upload_name is None or (e.progress != 1 and not e.error):
+            return
+        upload_name, self._upload_name = self._upload_name, None
+        image_url = self.image_url.current
+        image_url.helper_text = None
+        if e.error:
+            image_url.error_text = "上傳失敗"
+            await image_url.update_async()
+            return
+
+        try:
+            image_url.value = await image_store.store_upload(
+                UPLOAD_DIRECTORY / upload_name
+            )
+        except Exception:
+            image_url.error_text = "無法處理這張圖片"
+        await image_url.update_async()
 
     @staticmethod
     async def cancel(e: ft.ControlEvent) -> None:
@@ -40,6 +114,8 @@ class ItemForm(ft.UserControl):
 
         if name.error_text or description.error_text or price.error_text:
             return
+        if self._upload_name is not None:
+            return
         if not (name.value and description.value and price.value and category.value):
             return
         if not price.value.isdigit():
@@ -47,27 +123,26 @@ class ItemForm(ft.UserControl):
             await price.update_async()
             return
 
+        fields = {
+            "name": name.value,
+            "description": description.value,
+            "price": int(price.value),
+            "category": ItemCategory(category.value),
+            "image_url": image_url.value,
+        }
+        if image_url.value:
+            # Resize before the card and the carousels first show the image
+            await image_store.ensure(image_url.value)
         if self.is_create:
-            await Item.create(
-                name=name.value,
-                description=description.value,
-                price=int(price.value),
-                category=ItemCategory(category.value),
-                image_url=image_url.value,
-            )
+            self.items.insert(await Item.create(**fields))
         else:
             assert self.item
-            await Item.filter(id=self.item.id).update(
-                name=name.value,
-                description=description.value,
-                price=int(price.value),
-                category=ItemCategory(category.value),
-                image_url=image_url.value,
-            )
+            await Item.filter(id=self.item.id).update(**fields)
+            self.items.replace(self.item.update_from_dict(fields))
+        await menu_catalog.bump_version()
 
         e.page.views.pop()
         await e.page.update_async()
-        await e.page.go_async("/items/refresh")
 
     def build(self):
         return ft.SafeArea(
@@ -144,6 +219,14 @@ class ItemForm(ft.UserControl):
                                         if self.item
                                         else None,
                                     ),
+                                    ft.Container(
+                                        ft.OutlinedButton(
+                                            "上傳圖片",
+                                            icon=ft.icons.UPLOAD,
+                                            on_click=self.pick_image,
+                                        ),
+                                        alignment=ft.alignment.center_right,
+                                    ),
                                 ],
                                 spacing=12,
                             ),
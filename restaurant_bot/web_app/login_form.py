@@ -1,6 +1,6 @@
 import flet as ft
 
-from ..models import User
+from ..auth import authenticator
 
 
 class LoginForm(ft.UserControl):
@@ -12,7 +12,9 @@ class LoginForm(ft.UserControl):
     async def login(self, e: ft.ControlEvent):
         name = self.name.current.value
         password = self.password.current.value
-        user = await User.get_or_none(name=name, password=password)
+        user = await authenticator.authenticate(
+            name or "", password or "", e.page.client_ip or ""
+        )
         if user is None:
             self.name.current.error_text = "帳號或密碼錯誤"
             self.password.current.error_text = "帳號或密碼錯誤"
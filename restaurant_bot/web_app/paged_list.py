@@ -0,0 +1,131 @@
+from typing import Callable, Dict, Generic, List, Optional, TypeVar
+
+import flet as ft
+from tortoise.models import Model
+from tortoise.queryset import QuerySet
+
+MODEL = TypeVar("MODEL", bound=Model)
+
+
+class PagedList(ft.UserControl, Generic[MODEL]):
+    """
+    Newest-first list of cards that loads one page at a time while scrolling
+
+    Pages are fetched with a keyset on the id, so loading a page costs the
+    same no matter how far down the list it is. Edits are patched in with
+    `insert`, `replace` and `remove`, which only change the controls and
+    leave sending the update to the caller, except when removing the last
+    loaded card makes `remove` load the next page.
+
+    Parameters:
+        query: The rows to list
+        build_card: Creates the card of a row, given the row and this list
+        empty_text: Shown when there are no rows
+        page_size: How many rows are loaded at a time
+    """
+
+    def __init__(
+        self,
+        query: QuerySet[MODEL],
+        build_card: Callable[[MODEL, "PagedList[MODEL]"], ft.Control],
+        empty_text: str,
+        *,
+        page_size: int = 20,
+    ) -> None:
+        super().__init__(expand=True)
+        self.query = query
+        self.build_card = build_card
+        self.empty_text = empty_text
+        self.page_size = page_size
+        self.list_view = ft.Ref[ft.ListView]()
+        self.cards: Dict[int, ft.Control] = {}
+        self.empty_placeholder = ft.Container(
+            ft.Text(empty_text), alignment=ft.alignment.center
+        )
+
+        self._last_id: Optional[int] = None
+        self._exhausted = False
+        self._loading = False
+
+    async def _fetch_page(self) -> List[MODEL]:
+        query = self.query.order_by("-id").limit(self.page_size)
+        if self._last_id is not None:
+            query = query.filter(id__lt=self._last_id)
+        rows = await query
+        if len(rows) < self.page_size:
+            self._exhausted = True
+        if rows:
+            self._last_id = rows[-1].pk
+        return rows
+
+    async def load_more(self) -> None:
+        if self._exhausted or self._loading:
+            return
+        self._loading = True
+        try:
+            rows = await self._fetch_page()
+        finally:
+            self._loading = False
+
+        list_view = self.list_view.current
+        if not rows and not list_view.controls:
+            list_view.controls.append(self.empty_placeholder)
+        for row in rows:
+            card = self.build_card(row, self)
+            self.cards[row.pk] = card
+            list_view.controls.append(card)
+        await list_view.update_async()
+
+    def insert(self, row: MODEL) -> None:
+        """
+        Add the card of a new row at the top
+        """
+        controls = self.list_view.current.controls
+        if self.empty_placeholder in controls:
+            controls.remove(self.empty_placeholder)
+        card = self.build_card(row, self)
+        self.cards[row.pk] = card
+        controls.insert(0, card)
+
+    def replace(self, row: MODEL) -> None:
+        """
+        Rebuild the card of an edited row in place
+        """
+        old_card = self.cards.get(row.pk)
+        if old_card is None:
+            return
+        controls = self.list_view.current.controls
+        card = self.build_card(row, self)
+        self.cards[row.pk] = card
+        controls[controls.index(old_card)] = card
+
+    async def remove(self, pk: int) -> None:
+        card = self.cards.pop(pk, None)
+        if card is None:
+            return
+        controls = self.list_view.current.controls
+        controls.remove(card)
+        if controls:
+            return
+        if self._exhausted:
+            controls.append(self.empty_placeholder)
+        else:
+            # Without cards there is nothing to scroll, so on_scroll never loads more
+            await self.load_more()
+
+    async def on_scroll(self, e: ft.OnScrollEvent) -> None:
+        # Start loading the next page a little before the end is reached
+        if e.pixels >= e.max_scroll_extent - 300:
+            await self.load_more()
+
+    async def did_mount_async(self):
+        await self.load_more()
+
+    def build(self):
+        return ft.ListView(
+            ref=self.list_view,
+            expand=True,
+            spacing=12,
+            on_scroll=self.on_scroll,
+            on_scroll_interval=100,
+        )
@@ -0,0 +1,73 @@
+import flet as ft
+
+from ..reports import SalesReport
+
+
+class SalesReportView(ft.UserControl):
+    def __init__(self, report: SalesReport):
+        super().__init__()
+        self.report = report
+
+    def _section(self, title: str, rows: list) -> ft.Card:
+        return ft.Card(
+            ft.Container(
+                ft.Column(
+                    [ft.Text(title, size=22, weight=ft.FontWeight.W_700), *rows],
+                ),
+                padding=16,
+            )
+        )
+
+    def _bar(self, label: str, value: int, max_value: int, text: str) -> ft.Row:
+        return ft.Row(
+            [
+                ft.Text(label, width=90),
+                ft.ProgressBar(
+                    value=value / max_value if max_value else 0, expand=True
+                ),
+                ft.Text(text, width=90, text_align=ft.TextAlign.RIGHT),
+            ]
+        )
+
+    def build(self):
+        report = self.report
+        max_revenue = max((day.revenue for day in report.daily_sales), default=0)
+        max_quantity = max(
+            (item["total_quantity"] for item in report.top_items), default=0
+        )
+        max_orders = max(report.orders_per_hour.values(), default=0)
+
+        summary = ft.Text(f"營業額: ${report.revenue}\n訂單數: {report.order_count}", size=18)
+        revenue_rows = [
+            self._bar(
+                day.date.strftime("%m/%d"),
+                day.revenue,
+                max_revenue,
+                f"${day.revenue}",
+            )
+            for day in report.daily_sales
+        ] or [ft.Text("目前沒有任何訂單")]
+        item_rows = [
+            self._bar(
+                item["item_name"],
+                item["total_quantity"],
+                max_quantity,
+                f"{item['total_quantity']} 份",
+            )
+            for item in report.top_items
+        ] or [ft.Text("目前沒有任何訂單")]
+        hour_rows = [
+            self._bar(f"{hour:02d}:00", count, max_orders, f"{count} 筆")
+            for hour, count in report.orders_per_hour.items()
+            if count
+        ] or [ft.Text("目前沒有任何訂單")]
+
+        return ft.Column(
+            [
+                self._section("近 30 天", [summary]),
+                self._section("每日營業額", revenue_rows),
+                self._section("熱銷餐點", item_rows),
+                self._section("每小時訂單數", hour_rows),
+            ],
+            spacing=12,
+        )
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from multiprocessing.process import BaseProcess
+from multiprocessing.sharedctypes import Synchronized
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+WorkerTarget = Callable[[int, "Synchronized[float]"], None]
+
+
+class Worker:
+    def __init__(self, worker_id: int, process: BaseProcess, heartbeat: Any) -> None:
+        self.worker_id = worker_id
+        self.process = process
+        self.heartbeat: "Synchronized[float]" = heartbeat
+        self.started_at = time.time()
+        self.restarts = 0
+
+    @property
+    def is_ready(self) -> bool:
+        # Workers only start beating once they are listening
+        return self.heartbeat.value != 0
+
+    @property
+    def heartbeat_age(self) -> float:
+        # Workers that haven't sent a heartbeat yet are measured from their start
+        return time.time() - (self.heartbeat.value or self.started_at)
+
+
+class WorkerPool:
+    """
+    Pre-fork supervisor that keeps `count` worker processes running
+
+    Workers bind the same port with SO_REUSEPORT and report a heartbeat through
+    shared memory once they are listening. The parent restarts workers that die
+    or stop beating, does a rolling restart on SIGHUP, logs the pool status on
+    SIGUSR1 and shuts the workers down gracefully on SIGTERM/SIGINT.
+
+    Parameters:
+        target: Called in every worker process with its id and heartbeat value
+        count: How many workers to run
+        heartbeat_timeout: Seconds without a heartbeat before a worker is restarted
+        startup_timeout: Seconds a new worker gets to start listening
+        shutdown_timeout: Seconds a worker gets to exit before it is killed
+    """
+
+    def __init__(
+        self,
+        target: WorkerTarget,
+        count: int,
+        *,
+        heartbeat_timeout: float = 30,
+        startup_timeout: float = 120,
+        shutdown_timeout: float = 10,
+    ) -> None:
+        self.target = target
+        self.count = count
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.workers: Dict[int, Worker] = {}
+
+        self._context = multiprocessing.get_context("spawn")
+        self._stopping = False
+        self._reload_requested = False
+        self._status_requested = False
+
+    def _spawn(self, worker_id: int) -> Worker:
+        heartbeat = self._context.Value("d", 0.0, lock=False)
+        process = self._context.Process(
+            target=self.target,
+            args=(worker_id, heartbeat),
+            name=f"restaurant-bot-worker-{worker_id}",
+            daemon=False,
+        )
+        process.start()
+        worker = Worker(worker_id, process, heartbeat)
+        logging.info("Started worker %d (pid %s)", worker_id, process.pid)
+        return worker
+
+    def _stop_worker(self, worker: Worker) -> None:
+        process = worker.process
+        if process.is_alive():
+            process.terminate()
+        process.join(self.shutdown_timeout)
+        if process.is_alive():
+            logging.warning("Worker %d didn't exit in time, killing", worker.worker_id)
+            process.kill()
+            process.join()
+
+    def _replace(self, worker: Worker) -> None:
+        self._stop_worker(worker)
+        new_worker = self._spawn(worker.worker_id)
+        new_worker.restarts = worker.restarts + 1
+        self.workers[worker.worker_id] = new_worker
+
+    def _wait_until_ready(self, worker: Worker) -> bool:
+        deadline = time.time() + self.startup_timeout
+        while not worker.is_ready:
+            if (
+                self._stopping
+                or not worker.process.is_alive()
+                or time.time() > deadline
+            ):
+                return False
+            time.sleep(0.1)
+        return True
+
+    def _check_health(self) -> None:
+        for worker in list(self.workers.values()):
+            if not worker.process.is_alive():
+                logging.warning(
+                    "Worker %d exited with code %s, restarting",
+                    worker.worker_id,
+                    worker.process.exitcode,
+                )
+                self._replace(worker)
+            elif not worker.is_ready:
+                if worker.heartbeat_age > self.startup_timeout:
+                    logging.warning(
+                        "Worker %d didn't start listening in %.0fs, restarting",
+                        worker.worker_id,
+                        worker.heartbeat_age,
+                    )
+                    self._replace(worker)
+            elif worker.heartbeat_age > self.heartbeat_timeout:
+                logging.warning(
+                    "Worker %d missed its heartbeat for %.0fs, restarting",
+                    worker.worker_id,
+                    worker.heartbeat_age,
+                )
+                self._replace(worker)
+
+    def _reload(self) -> None:
+        """
+        Replace the workers one at a time, each is stopped only once its
+        replacement is listening so the port is never left unserved
+        """
+        logging.info("Reloading workers")
+        for worker in list(self.workers.values()):
+            new_worker = self._spawn(worker.worker_id)
+            if not self._wait_until_ready(new_worker):
+                logging.error(
+                    "Replacement of worker %d didn't start, stopping the reload",
+                    worker.worker_id,
+                )
+                self._stop_worker(new_worker)
+                return
+            new_worker.restarts = worker.restarts + 1
+            self.workers[worker.worker_id] = new_worker
+            self._stop_worker(worker)
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "worker_id": worker.worker_id,
+                "pid": worker.process.pid,
+                "alive": worker.process.is_alive(),
+                "ready": worker.is_ready,
+                "healthy": worker.process.is_alive()
+                and worker.heartbeat_age <= self.heartbeat_timeout,
+                "heartbeat_age": round(worker.heartbeat_age, 1),
+                "uptime": round(time.time() - worker.started_at),
+                "restarts": worker.restarts,
+            }
+            for worker in self.workers.values()
+        ]
+
+    def _log_status(self) -> None:
+        status = self.status()
+        healthy = sum(worker["healthy"] for worker in status)
+        logging.info("%d/%d workers healthy", healthy, self.count)
+        for worker in status:
+            logging.info("Worker status: %s", worker)
+
+    def _on_stop(self, *_: Any) -> None:
+        self._stopping = True
+
+    def _on_reload(self, *_: Any) -> None:
+        self._reload_requested = True
+
+    def _on_status(self, *_: Any) -> None:
+        self._status_requested = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGUSR1, self._on_status)
+
+        for worker_id in range(self.count):
+            self.workers[worker_id] = self._spawn(worker_id)
+        self._log_status()
+
+        while not self._stopping:
+            time.sleep(1)
+            if self._reload_requested:
+                self._reload_requested = False
+                self._reload()
+            if self._status_requested:
+                self._status_requested = False
+                self._log_status()
+            if not self._stopping:
+                self._check_health()
+
+        logging.info("Shutting down workers")
+        for worker in self.workers.values():
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers.values():
+            self._stop_worker(worker)
+
+
+def _is_listening(port: int) -> bool:
+    """
+    Whether this process has a socket listening on the port, read from /proc
+    since SO_REUSEPORT lets every worker listen on it at once
+    """
+    inodes = set()
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            target = os.readlink(f"/proc/self/fd/{fd}")
+        except OSError:
+            continue
+        if target.startswith("socket:["):
+            inodes.add(target[8:-1])
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as file:
+                rows = file.readlines()[1:]
+        except FileNotFoundError:
+            continue
+        for row in rows:
+            fields = row.split()
+            local_address, state, inode = fields[1], fields[3], fields[9]
+            # 0A is TCP_LISTEN
+            if (
+                state == "0A"
+                and int(local_address.rsplit(":", 1)[1], 16) == port
+                and inode in inodes
+            ):
+                return True
+    return False
+
+
+async def _beat(heartbeat: "Synchronized[float]", port: int, interval: float) -> None:
+    # The first beat tells the supervisor the worker is ready
+    while not _is_listening(port):
+        await asyncio.sleep(0.1)
+    while True:
+        heartbeat.value = time.time()
+        await asyncio.sleep(interval)
+
+
+async def serve_worker(
+    run: Awaitable[None],
+    on_close: Callable[[], Awaitable[None]],
+    heartbeat: "Synchronized[float]",
+    *,
+    port: int,
+    heartbeat_interval: float = 2,
+) -> None:
+    """
+    Run the bot in a worker process until the supervisor asks it to stop
+
+    Parameters:
+        run: Starts the bot's server and runs it
+        on_close: Called after the server has stopped
+        heartbeat: Set to the time of every heartbeat
+        port: The port the server listens on, the heartbeat starts once it does
+        heartbeat_interval: Seconds between heartbeats
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    # Ctrl+C reaches the whole process group, leave the shutdown to the parent
+    loop.add_signal_handler(signal.SIGINT, lambda: None)
+
+    run_task = asyncio.ensure_future(run)
+    beat_task = asyncio.create_task(_beat(heartbeat, port, heartbeat_interval))
+    stop_task = asyncio.create_task(stop.wait())
+    error: Optional[BaseException] = None
+    try:
+        await asyncio.wait({run_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        if run_task.done():
+            error = run_task.exception()
+    finally:
+        for task in (run_task, beat_task, stop_task):
+            task.cancel()
+        await asyncio.gather(run_task, beat_task, stop_task, return_exceptions=True)
+        await on_close()
+    if error is not None:
+        raise error
@@ -1,22 +1,75 @@
 import asyncio
+import logging
 import os
+from multiprocessing.sharedctypes import Synchronized
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from dotenv import load_dotenv
 
 from restaurant_bot.bot import RestaurantBot
+from restaurant_bot.workers import WorkerPool, serve_worker
 
 
-async def main() -> None:
+def with_pool_size(db_url: str, pool_size: Optional[int]) -> str:
+    """
+    Limit the Postgres connection pool of a single worker, SQLite has no pool
+    """
+    parts = urlsplit(db_url)
+    if not pool_size or not parts.scheme.startswith(("postgres", "asyncpg")):
+        return db_url
+    query = dict(parse_qsl(parts.query))
+    query["minsize"] = "1"
+    query["maxsize"] = str(pool_size)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+async def main(
+    worker_id: int = 0, heartbeat: Optional["Synchronized[float]"] = None
+) -> None:
     load_dotenv()
     channel_secret = os.getenv("LINE_CHANNEL_SECRET")
     access_token = os.getenv("LINE_ACCESS_TOKEN")
-    if not (channel_secret and access_token):
-        raise RuntimeError("LINE_CHANNEL_SECRET and LINE_ACCESS_TOKEN are required.")
+    public_url = os.getenv("PUBLIC_URL")
+    if not (channel_secret and access_token and public_url):
+        raise RuntimeError(
+            "LINE_CHANNEL_SECRET, LINE_ACCESS_TOKEN and PUBLIC_URL are required."
+        )
+    pool_size = os.getenv("DB_POOL_SIZE")
 
     bot = RestaurantBot(
-        channel_secret, access_token, os.getenv("DB_URL") or "sqlite://db.sqlite3"
+        channel_secret,
+        access_token,
+        with_pool_size(
+            os.getenv("DB_URL") or "sqlite://db.sqlite3",
+            int(pool_size) if pool_size else None,
+        ),
+        public_url,
+        primary=worker_id == 0,
+        shared_dedupe=heartbeat is not None,
+        query_metrics=True,
     )
-    await bot.run(port=7030, custom_route="/restaurant/line")
+    if heartbeat is None:
+        await bot.run(port=7030, custom_route="/restaurant/line")
+    else:
+        await serve_worker(
+            bot.run(port=7030, custom_route="/restaurant/line", reuse_port=True),
+            bot.on_close,
+            heartbeat,
+            port=7030,
+        )
+
 
+def run_worker(worker_id: int, heartbeat: "Synchronized[float]") -> None:
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(worker_id, heartbeat))
 
-asyncio.run(main())
+
+if __name__ == "__main__":
+    load_dotenv()
+    workers = int(os.getenv("WORKERS") or 1)
+    if workers > 1:
+        logging.basicConfig(level=logging.INFO)
+        WorkerPool(run_worker, workers).run()
+    else:
+        asyncio.run(main())
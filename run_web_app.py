@@ -1,32 +1,54 @@
 import asyncio
 import os
+from typing import Optional
 
 import flet as ft
 from dotenv import load_dotenv
 from tortoise import Tortoise
 
+from restaurant_bot.http_client import HTTPClient
+from restaurant_bot.images import image_store
+from restaurant_bot.migrations import migrate
 from restaurant_bot.models import Coupon, Item
-from restaurant_bot.web_app import CouponCard, CouponForm, ItemCard, ItemForm, LoginForm
+from restaurant_bot.reports import get_sales_report
+from restaurant_bot.web_app import (
+    UPLOAD_DIRECTORY,
+    CouponCard,
+    CouponForm,
+    ItemCard,
+    ItemForm,
+    LoginForm,
+    PagedList,
+    SalesReportView,
+)
 
 load_dotenv()
 
 ROUTES = {
     0: "/items",
     1: "/coupons",
+    2: "/reports",
 }
 
 
 async def main(page: ft.Page):
+    # The list on the current route, forms patch their changes into it
+    paged_list: Optional[PagedList] = None
+
     async def on_click(e: ft.ControlEvent):
+        if paged_list is None:
+            return
         if e.page.route == "/items":
-            page.views.append(ft.View(controls=[ItemForm()]))
+            page.views.append(ft.View(controls=[ItemForm(paged_list)]))
             await page.update_async()
         elif e.page.route == "/coupons":
-            page.views.append(ft.View(controls=[CouponForm()]))
+            page.views.append(ft.View(controls=[CouponForm(paged_list)]))
             await page.update_async()
 
     async def on_route_change(e: ft.RouteChangeEvent):
+        nonlocal paged_list
         page.controls = []
+        paged_list = None
 
         if not e.page.session.get("authed"):
             page.views.append(ft.View(controls=[LoginForm()]))
@@ -36,38 +58,21 @@ async def main(page: ft.Page):
         if e.route == "/items/refresh":
             await page.go_async("/items")
         elif e.route == "/items":
-            items = await Item.all()
-            if not items:
-                return page.controls.append(
-                    ft.Container(
-                        ft.Text("目前沒有任何餐點, 點擊右下角按鈕新增餐點"),
-                        alignment=ft.alignment.center,
-                    )
-                )
-
-            list_view = ft.ListView(expand=True, spacing=12)
-            for item in reversed(items):
-                card = ItemCard(item)
-                list_view.controls.append(card)
-            page.controls.append(list_view)
+            paged_list = PagedList(Item.all(), ItemCard, "目前沒有任何餐點, 點擊右下角按鈕新增餐點")
+            page.controls.append(paged_list)
             await page.update_async()
         elif e.route == "/coupons/refresh":
             await page.go_async("/coupons")
         elif e.route == "/coupons":
-            coupons = await Coupon.all()
-            if not coupons:
-                return page.controls.append(
-                    ft.Container(
-                        ft.Text("目前沒有任何優惠卷, 點擊右下角按鈕新增優惠卷"),
-                        alignment=ft.alignment.center,
-                    )
-                )
-
-            list_view = ft.ListView(expand=True, spacing=12)
-            for coupon in reversed(coupons):
-                card = CouponCard(coupon)
-                list_view.controls.append(card)
-            page.controls.append(list_view)
+            paged_list = PagedList(Coupon.all(), CouponCard, "目前沒有任何優惠卷, 點擊右下角按鈕新增優惠卷")
+            page.controls.append(paged_list)
+            await page.update_async()
+        elif e.route == "/reports":
+            # Only reads the rollups, the bot's SalesRollupJob keeps them up to date
+            report = await get_sales_report()
+            page.controls.append(
+                ft.ListView([SalesReportView(report)], expand=True, padding=12)
+            )
             await page.update_async()
 
     async def on_change(e: ft.ControlEvent):
@@ -87,6 +92,11 @@ async def main(page: ft.Page):
                 selected_icon_content=ft.Icon(ft.icons.SELL),
                 label="優惠卷",
             ),
+            ft.NavigationDestination(
+                icon=ft.icons.INSIGHTS_OUTLINED,
+                selected_icon=ft.icons.INSIGHTS,
+                label="報表",
+            ),
         ],
         on_change=on_change,
     )
@@ -103,10 +113,17 @@ loop.run_until_complete(
         modules={"models": ["restaurant_bot.models"]},
     )
 )
-loop.run_until_complete(Tortoise.generate_schemas())
-ft.app(target=main, port=7031, view=None)
+loop.run_until_complete(migrate())
+# Item images are resized here and served by the bot at PUBLIC_URL
+http_client = HTTPClient()
+loop.run_until_complete(http_client.start())
+loop.run_until_complete(image_store.start(http_client, os.getenv("PUBLIC_URL")))
+# Uploads need the FLET_SECRET_KEY environment variable to be set
+UPLOAD_DIRECTORY.mkdir(parents=True, exist_ok=True)
+ft.app(target=main, port=7031, view=None, upload_dir=str(UPLOAD_DIRECTORY))
 
 
 loop = asyncio.get_event_loop()
+loop.run_until_complete(http_client.close())
 loop.run_until_complete(Tortoise.close_connections())
 loop.close()
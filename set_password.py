@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+import getpass
+import os
+
+from dotenv import load_dotenv
+from tortoise import Tortoise
+
+from restaurant_bot.auth import hash_password
+from restaurant_bot.migrations import migrate
+from restaurant_bot.models import User
+
+
+async def main(user_id: str, login_name: str) -> None:
+    password = getpass.getpass("Password: ")
+    if password != getpass.getpass("Confirm password: "):
+        raise SystemExit("Passwords don't match")
+
+    await Tortoise.init(
+        db_url=os.getenv("DB_URL") or "sqlite://db.sqlite3",
+        modules={"models": ["restaurant_bot.models"]},
+    )
+    try:
+        await migrate()
+        updated = await User.filter(id=user_id).update(
+            login_name=login_name,
+            password=await asyncio.to_thread(hash_password, password),
+            is_admin=True,
+        )
+    finally:
+        await Tortoise.close_connections()
+    if not updated:
+        raise SystemExit(f"User {user_id} doesn't exist")
+    print(f"{login_name} can now log in to the web app")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Make a user an admin of the web app")
+    parser.add_argument("user_id", help="The LINE user id")
+    parser.add_argument("login_name", help="The name used to log in")
+    args = parser.parse_args()
+    asyncio.run(main(args.user_id, args.login_name))
@@ -0,0 +1,24 @@
+from typing import AsyncIterator
+
+import pytest
+from tortoise import Tortoise
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+async def db() -> AsyncIterator[None]:
+    """
+    A fresh in-memory SQLite database with every table created
+    """
+    await Tortoise.init(
+        db_url="sqlite://:memory:", modules={"models": ["restaurant_bot.models"]}
+    )
+    await Tortoise.generate_schemas()
+    try:
+        yield
+    finally:
+        await Tortoise.close_connections()
@@ -0,0 +1,104 @@
+import pytest
+
+from restaurant_bot import auth
+from restaurant_bot.auth import (
+    Authenticator,
+    LoginRateLimiter,
+    hash_password,
+    is_password_hash,
+    verify_password,
+)
+from restaurant_bot.models import User
+
+pytestmark = pytest.mark.anyio
+
+# Cheap parameters keep the tests fast, they are stored in the hash
+FAST = {"n": 2**4, "r": 8, "p": 1}
+
+
+def test_hash_round_trip() -> None:
+    password_hash = hash_password("secret", **FAST)
+
+    assert is_password_hash(password_hash)
+    assert verify_password("secret", password_hash)
+    assert not verify_password("Secret", password_hash)
+
+
+def test_hashes_are_salted() -> None:
+    assert hash_password("secret", **FAST) != hash_password("secret", **FAST)
+
+
+@pytest.mark.parametrize("stored", ["secret", "", "scrypt$broken"])
+def test_plaintext_and_malformed_hashes_never_match(stored: str) -> None:
+    assert not verify_password("secret", stored)
+
+
+def test_rate_limiter_blocks_after_max_failures(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    now = 1000.0
+    monkeypatch.setattr(auth.time, "monotonic", lambda: now)
+    limiter = LoginRateLimiter(max_failures=3, window=60)
+
+    for _ in range(3):
+        assert not limiter.is_blocked("key")
+        limiter.record_failure("key")
+    assert limiter.is_blocked("key")
+    assert not limiter.is_blocked("other")
+
+    now += 61
+    assert not limiter.is_blocked("key")
+
+
+def test_rate_limiter_reset() -> None:
+    limiter = LoginRateLimiter(max_failures=1)
+    limiter.record_failure("key")
+
+    limiter.reset("key")
+
+    assert not limiter.is_blocked("key")
+
+
+@pytest.fixture
+async def admin(db: None) -> User:
+    return await User.create(
+        id="U1",
+        name="boss",
+        login_name="boss",
+        is_admin=True,
+        password=hash_password("secret", **FAST),
+    )
+
+
+async def test_authenticate(admin: User) -> None:
+    authenticator = Authenticator()
+
+    assert await authenticator.authenticate("boss", "secret", "10.0.0.1") == admin
+    assert await authenticator.authenticate("boss", "wrong", "10.0.0.1") is None
+    assert await authenticator.authenticate("nobody", "secret", "10.0.0.1") is None
+
+
+async def test_non_admins_cannot_log_in(admin: User) -> None:
+    await User.filter(id=admin.id).update(is_admin=False)
+
+    assert await Authenticator().authenticate("boss", "secret") is None
+
+
+async def test_failures_lock_out_the_client(admin: User) -> None:
+    authenticator = Authenticator()
+    for _ in range(authenticator.rate_limiter.max_failures):
+        await authenticator.authenticate("guess", "wrong", "10.0.0.1")
+
+    assert await authenticator.authenticate("boss", "secret", "10.0.0.1") is None
+    assert await authenticator.authenticate("boss", "secret", "10.0.0.2") == admin
+
+
+async def test_failures_without_a_client_ip_lock_out_only_the_name(
+    admin: User,
+) -> None:
+    authenticator = Authenticator()
+    for _ in range(authenticator.rate_limiter.max_failures):
+        await authenticator.authenticate("guess", "wrong", "")
+
+    assert await authenticator.authenticate("boss", "secret", "") == admin
+    assert await authenticator.authenticate("guess", "wrong", "") is None
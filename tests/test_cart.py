@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("line")
+
+from restaurant_bot.cogs.order import Cart  # noqa: E402
+from restaurant_bot.models import CartLine, Item, ItemCategory, User  # noqa: E402
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def item(db: None) -> Item:
+    await User.create(id="U1", name="user")
+    return await Item.create(
+        name="餐點", description="", category=ItemCategory.FOOD, price=100
+    )
+
+
+async def get_quantity(item: Item) -> int:
+    line = await CartLine.get(user_id="U1", item_id=item.id)
+    return line.quantity
+
+
+async def test_add_creates_and_increments_the_line(item: Item) -> None:
+    await Cart.add("U1", item.id, 2)
+    await Cart.add("U1", item.id, 3)
+
+    assert await get_quantity(item) == 5
+    assert await CartLine.all().count() == 1
+
+
+async def test_concurrent_adds_are_all_counted(item: Item) -> None:
+    await asyncio.gather(*(Cart.add("U1", item.id, 1) for _ in range(10)))
+
+    assert await get_quantity(item) == 10
+    assert await CartLine.all().count() == 1
+
+
+async def test_remove_decrements_and_deletes_the_line(item: Item) -> None:
+    await Cart.add("U1", item.id, 3)
+
+    await Cart.remove("U1", item.id, 1)
+    assert await get_quantity(item) == 2
+
+    await Cart.remove("U1", item.id, 5)
+    assert not await CartLine.exists(user_id="U1", item_id=item.id)
+
+
+async def test_concurrent_removes_never_go_negative(item: Item) -> None:
+    await Cart.add("U1", item.id, 3)
+
+    await asyncio.gather(*(Cart.remove("U1", item.id, 1) for _ in range(5)))
+
+    assert not await CartLine.exists(user_id="U1", item_id=item.id)
+
+
+async def test_checkout_records_the_order_and_clears_the_cart(item: Item) -> None:
+    await Cart.add("U1", item.id, 2)
+
+    cart = await Cart().create("U1")
+    order = await cart.checkout("U1")
+
+    assert order.total_price == 200
+    lines = await order.lines.all()
+    assert [(line.item_name, line.quantity) for line in lines] == [("餐點", 2)]
+    assert not await CartLine.exists(user_id="U1")
+
+
+async def test_checkout_keeps_items_added_after_the_cart_was_read(item: Item) -> None:
+    await Cart.add("U1", item.id, 2)
+
+    cart = await Cart().create("U1")
+    await Cart.add("U1", item.id, 1)
+    order = await cart.checkout("U1")
+
+    assert order.total_price == 200
+    assert await CartLine.filter(user_id="U1").values_list("quantity", flat=True) == [1]
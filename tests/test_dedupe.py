@@ -0,0 +1,113 @@
+import itertools
+from typing import Optional
+
+import pytest
+from linebot.v3.webhooks import MessageEvent, PostbackEvent
+
+from restaurant_bot import dedupe
+from restaurant_bot.dedupe import EventDeduplicator, TTLKeySet
+
+pytestmark = pytest.mark.anyio
+
+_event_ids = itertools.count()
+
+
+def postback(data: str, event_id: Optional[str] = None) -> PostbackEvent:
+    return PostbackEvent.from_dict(
+        {
+            "type": "postback",
+            "mode": "active",
+            "timestamp": 0,
+            "source": {"type": "user", "userId": "U1"},
+            "webhookEventId": event_id or f"EVENT{next(_event_ids)}",
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": "token",
+            "postback": {"data": data},
+        }
+    )
+
+
+def message(text: str) -> MessageEvent:
+    return MessageEvent.from_dict(
+        {
+            "type": "message",
+            "mode": "active",
+            "timestamp": 0,
+            "source": {"type": "user", "userId": "U1"},
+            "webhookEventId": f"EVENT{next(_event_ids)}",
+            "deliveryContext": {"isRedelivery": False},
+            "replyToken": "token",
+            "message": {"type": "text", "id": "1", "quoteToken": "q", "text": text},
+        }
+    )
+
+
+def test_ttl_key_set_forgets_expired_keys(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 100.0
+    monkeypatch.setattr(dedupe.time, "monotonic", lambda: now)
+    keys = TTLKeySet(ttl=3, max_size=10)
+
+    assert keys.add("a")
+    assert not keys.add("a")
+    now += 3.1
+    assert keys.add("a")
+
+
+def test_ttl_key_set_is_bounded() -> None:
+    keys = TTLKeySet(ttl=60, max_size=2)
+    for key in "abc":
+        assert keys.add(key)
+
+    # The oldest key was dropped to make room
+    assert keys.add("a")
+
+
+async def test_redelivered_event_is_dropped() -> None:
+    deduplicator = EventDeduplicator()
+
+    assert not await deduplicator.is_duplicate(postback("cmd=order", "EVENT"))
+    assert await deduplicator.is_duplicate(postback("cmd=order", "EVENT"))
+    assert deduplicator.duplicates == 1
+
+
+@pytest.mark.parametrize("data", ["cmd=checkout", "cmd=order_item&item_id=1&amount=1"])
+async def test_double_tapped_state_changes_are_dropped(data: str) -> None:
+    deduplicator = EventDeduplicator()
+
+    assert not await deduplicator.is_duplicate(postback(data))
+    assert await deduplicator.is_duplicate(postback(data))
+
+
+async def test_duplicate_give_points_message_is_dropped() -> None:
+    deduplicator = EventDeduplicator()
+    text = "cmd=give_points&user_id=U2&points=10"
+
+    assert not await deduplicator.is_duplicate(message(text))
+    assert await deduplicator.is_duplicate(message(text))
+    assert not await deduplicator.is_duplicate(message("hello"))
+    assert not await deduplicator.is_duplicate(message("hello"))
+
+
+async def test_repeats_are_kept_without_postback_commands() -> None:
+    deduplicator = EventDeduplicator(postback_commands=())
+
+    assert not await deduplicator.is_duplicate(postback("cmd=checkout"))
+    assert not await deduplicator.is_duplicate(postback("cmd=checkout"))
+
+
+@pytest.mark.parametrize(
+    "data", ["cmd=order", "cmd=continue_order", "cmd=show_coupons&index=1"]
+)
+async def test_repeated_taps_of_other_postbacks_are_handled(data: str) -> None:
+    deduplicator = EventDeduplicator()
+
+    assert not await deduplicator.is_duplicate(postback(data))
+    assert not await deduplicator.is_duplicate(postback(data))
+
+
+async def test_database_mode_shares_keys(db: None) -> None:
+    first = EventDeduplicator(use_database=True)
+    second = EventDeduplicator(use_database=True)
+
+    assert not await first.is_duplicate(postback("cmd=checkout", "EVENT"))
+    assert await second.is_duplicate(postback("cmd=checkout", "EVENT"))
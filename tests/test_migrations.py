@@ -0,0 +1,119 @@
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+from tortoise import Tortoise
+
+from restaurant_bot import migrations
+from restaurant_bot.auth import verify_password
+from restaurant_bot.models import CartLine, User, UserCoupon
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def db_file(tmp_path: Path) -> AsyncIterator[None]:
+    # A file so migration_lock takes its file lock like in production
+    await Tortoise.init(
+        db_url=f"sqlite://{tmp_path / 'db.sqlite3'}",
+        modules={"models": ["restaurant_bot.models"]},
+    )
+    try:
+        yield
+    finally:
+        await Tortoise.close_connections()
+
+
+async def execute(sql: str) -> None:
+    await Tortoise.get_connection("default").execute_script(sql)
+
+
+# The tables as generate_schemas created them before the migrations existed
+LEGACY_SCHEMA = """
+CREATE TABLE "coupon" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" VARCHAR(20) NOT NULL,
+    "description" VARCHAR(50) NOT NULL,
+    "expire_date" DATE NOT NULL
+);
+CREATE TABLE "user" (
+    "id" VARCHAR(33) NOT NULL PRIMARY KEY,
+    "name" VARCHAR(255) NOT NULL,
+    "points" INT NOT NULL DEFAULT 0,
+    "is_admin" INT NOT NULL DEFAULT 0,
+    "password" VARCHAR(255),
+    "cart" JSON NOT NULL,
+    "coupon_ids" JSON NOT NULL
+);
+CREATE TABLE "item" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" VARCHAR(20) NOT NULL,
+    "description" VARCHAR(50) NOT NULL,
+    "category" VARCHAR(20) NOT NULL,
+    "price" INT NOT NULL,
+    "image_url" VARCHAR(255)
+);
+INSERT INTO "coupon" VALUES (1, '優惠卷', '', '2999-01-01');
+INSERT INTO "item" VALUES (1, '餐點', '', '食物', 100, NULL);
+INSERT INTO "user" VALUES ('U1', 'boss', 0, 1, 'secret', '[1, 1]', '[1]');
+INSERT INTO "user" VALUES ('U2', 'member', 0, 0, NULL, '[]', '[]');
+"""
+
+
+async def test_new_database_gets_the_latest_version(db_file: None) -> None:
+    await migrations.migrate()
+
+    assert await migrations.get_schema_version() == migrations.LATEST_VERSION
+
+
+async def test_legacy_database_is_upgraded(db_file: None) -> None:
+    await execute(LEGACY_SCHEMA)
+
+    await migrations.migrate()
+
+    assert await migrations.get_schema_version() == migrations.LATEST_VERSION
+    admin = await User.get(id="U1")
+    assert admin.login_name == "boss"
+    assert verify_password("secret", admin.password or "")
+    assert admin.cart == [] and admin.coupon_ids == []
+    assert (await User.get(id="U2")).login_name is None
+    line = await CartLine.get(user_id="U1")
+    assert (line.item_id, line.quantity) == (1, 2)
+    holding = await UserCoupon.get(user_id="U1")
+    assert (holding.coupon_id, holding.quantity) == (1, 1)
+
+
+async def test_migration_half_applied_before_a_crash_runs_again(
+    db_file: None,
+) -> None:
+    await migrations.migrate()
+    # The column and index exist but the migration wasn't recorded
+    await execute(
+        f"DELETE FROM schemamigration WHERE version = {migrations.LATEST_VERSION}"
+    )
+
+    await migrations.migrate()
+
+    assert await migrations.get_schema_version() == migrations.LATEST_VERSION
+
+
+async def test_failed_migration_is_rolled_back(
+    db_file: None, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    await migrations.migrate()
+
+    async def failing_migration() -> None:
+        await Tortoise.get_connection("default").execute_query(
+            'ALTER TABLE "user" ADD COLUMN "nickname" VARCHAR(50)'
+        )
+        raise RuntimeError("failed halfway")
+
+    monkeypatch.setattr(
+        migrations, "MIGRATIONS", [*migrations.MIGRATIONS, ("fail", failing_migration)]
+    )
+    monkeypatch.setattr(migrations, "LATEST_VERSION", len(migrations.MIGRATIONS))
+    with pytest.raises(RuntimeError):
+        await migrations.migrate()
+
+    assert "nickname" not in await migrations._get_columns("user")
+    assert await migrations.get_schema_version() == migrations.LATEST_VERSION - 1
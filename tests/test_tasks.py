@@ -0,0 +1,59 @@
+import pytest
+
+from restaurant_bot.models import PointTransaction, User
+from restaurant_bot.tasks import BatchWriter
+
+pytestmark = pytest.mark.anyio
+
+
+def transaction(user_id: str, delta: int = 1) -> PointTransaction:
+    return PointTransaction(user_id=user_id, delta=delta, reason="test")
+
+
+@pytest.fixture
+async def user(db: None) -> User:
+    return await User.create(id="U1", name="user")
+
+
+async def test_flush_writes_in_batches(user: User) -> None:
+    writer = BatchWriter(PointTransaction, max_batch_size=2)
+    for _ in range(5):
+        writer.add(transaction(user.id))
+
+    await writer.flush()
+
+    assert writer.written == 5
+    assert await PointTransaction.all().count() == 5
+
+
+async def test_failed_batch_is_retried_then_written_row_by_row(user: User) -> None:
+    writer = BatchWriter(PointTransaction, max_attempts=2)
+    writer.add(transaction(user.id, 1))
+    # The user doesn't exist, so this row can never be written
+    writer.add(transaction("Udeleted", 2))
+
+    with pytest.raises(Exception):
+        await writer.flush()
+    assert await PointTransaction.all().count() == 0
+
+    await writer.flush()
+
+    assert writer.written == 1
+    assert writer.dropped == 1
+    assert await PointTransaction.all().values_list("delta", flat=True) == [1]
+    # Later batches are no longer held up
+    writer.add(transaction(user.id, 3))
+    await writer.flush()
+    assert await PointTransaction.all().count() == 2
+
+
+async def test_stop_writes_what_it_can_and_never_raises(user: User) -> None:
+    writer = BatchWriter(PointTransaction)
+    writer.start()
+    writer.add(transaction(user.id))
+    writer.add(transaction("Udeleted"))
+
+    await writer.stop()
+
+    assert writer.written == 1
+    assert writer.dropped == 1
@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+
+import pytest
+
+pytest.importorskip("line")
+
+from restaurant_bot.cogs.account import Wallet  # noqa: E402
+from restaurant_bot.models import Coupon, User, UserCoupon  # noqa: E402
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def user(db: None) -> User:
+    return await User.create(id="U1", name="user", points=10)
+
+
+async def get_points() -> int:
+    return (await User.get(id="U1")).points
+
+
+async def test_change_points_adds_and_deducts(user: User) -> None:
+    assert await Wallet.change_points(user.id, 5)
+    assert await Wallet.change_points(user.id, -15)
+    assert await get_points() == 0
+
+
+async def test_change_points_never_goes_negative(user: User) -> None:
+    assert not await Wallet.change_points(user.id, -11)
+    assert await get_points() == 10
+
+
+async def test_concurrent_deductions_stop_at_zero(user: User) -> None:
+    results = await asyncio.gather(
+        *(Wallet.change_points(user.id, -3) for _ in range(5))
+    )
+
+    assert results.count(True) == 3
+    assert await get_points() == 1
+
+
+async def test_grant_and_redeem_count_copies(user: User) -> None:
+    coupon = await Coupon.create(
+        name="優惠卷",
+        description="",
+        expire_date=datetime.date.today() + datetime.timedelta(days=1),
+    )
+    await asyncio.gather(
+        Wallet.grant(user.id, coupon.id), Wallet.grant(user.id, coupon.id)
+    )
+    assert (await UserCoupon.get(user_id=user.id, coupon_id=coupon.id)).quantity == 2
+
+    assert await Wallet.redeem(user.id, coupon.id)
+    assert await Wallet.redeem(user.id, coupon.id)
+    assert not await Wallet.redeem(user.id, coupon.id)
+    assert not await UserCoupon.exists(user_id=user.id, coupon_id=coupon.id)